@@ -0,0 +1,194 @@
+"""
+Store of decoded meme assets, so that the png files are read and decoded
+once instead of on every slider interaction
+"""
+
+import threading
+from collections import OrderedDict
+import cv2
+import numpy as np
+import config as cfg
+
+def premultiply(asset):
+    """
+    Multiply the colour channels of an rgba uint8 asset by its alpha
+    """
+    asset = np.array(asset, dtype = np.uint8) # copy, the asset may be shared
+    tmp = asset[:, :, 0:3].astype(np.uint16) * asset[:, :, 3:4]
+    asset[:, :, 0:3] = div255(tmp)
+    return asset
+
+def div255(tmp):
+    """
+    round(tmp / 255) for uint16 values up to 255 * 255, in place, without division
+    """
+    tmp += 128
+    tmp += tmp >> 8
+    tmp >>= 8
+    return tmp
+
+class CachedAsset:
+    """
+    A decoded asset (rgba uint8, premultiplied alpha) with a mip pyramid:
+    levels[0] is the asset and every next level is half the size of the previous one.
+    Flipped pyramids are built the first time they are requested.
+    All arrays are read-only, since they are shared by every caller
+    """
+    def __init__(self, image, min_side = 8):
+        self.shape = image.shape
+        self.min_side = min_side
+        self.levels = self.build_pyramid(image)
+        self.flipped = {(False, False): self.levels} # (flip_x, flip_y) -> pyramid
+
+    @property
+    def image(self):
+        return self.levels[0]
+
+    @property
+    def nbytes(self):
+        return sum(level.nbytes for levels in self.flipped.values() for level in levels)
+
+    def build_pyramid(self, image):
+        """
+        Halve the image (gaussian blur + decimation) until its smaller side
+        would drop below min_side
+        """
+        levels = [image]
+        while min(levels[-1].shape[:2]) // 2 >= self.min_side:
+            levels.append(cv2.pyrDown(levels[-1]))
+
+        for level in levels:
+            level.flags.writeable = False
+        return levels
+
+    def pyramid(self, flip_x = False, flip_y = False):
+        """
+        Pyramid of the asset flipped horizontally (flip_x) and/or vertically (flip_y)
+        """
+        key = (bool(flip_x), bool(flip_y))
+        levels = self.flipped.get(key)
+        if levels is None:
+            levels = []
+            for level in self.levels:
+                if key[0]:
+                    level = np.fliplr(level)
+                if key[1]:
+                    level = np.flipud(level)
+                level = np.ascontiguousarray(level)
+                level.flags.writeable = False
+                levels.append(level)
+            self.flipped[key] = levels
+        return levels
+
+    def resize(self, dims, flip_x = False, flip_y = False):
+        """
+        Return the (flipped) asset resized to dims = (width, height), starting
+        from the smallest pyramid level that is still at least as large as dims
+        """
+        w, h = dims
+        levels = self.pyramid(flip_x, flip_y)
+
+        level = levels[0]
+        for candidate in levels[1:]:
+            if candidate.shape[1] < w or candidate.shape[0] < h:
+                break
+            level = candidate
+
+        if (level.shape[1], level.shape[0]) == (w, h):
+            return level
+
+        # the level is less than twice as large as dims, so a bilinear
+        # resize is cheap and does not alias
+        return cv2.resize(level, (w, h), interpolation = cv2.INTER_LINEAR)
+
+class AssetStore:
+    """
+    LRU store of decoded assets (CachedAssets) bounded by max_bytes
+    """
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.assets = OrderedDict() # path -> decoded asset
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, path):
+        """
+        Return the decoded asset stored in path, decoding it on first use
+        """
+        with self.lock:
+            asset = self.assets.get(path)
+            if asset is not None:
+                self.assets.move_to_end(path)
+                self.hits += 1
+                return asset
+            self.misses += 1
+
+        asset = self.load(path)
+
+        with self.lock:
+            if path not in self.assets:
+                self.assets[path] = asset
+                self.evict()
+            return self.assets.get(path, asset)
+
+    def load(self, path):
+        """
+        Decode the asset in path
+        """
+        image = cv2.imread(path, cv2.IMREAD_UNCHANGED)
+        if image is None:
+            raise IOError(f'Could not read asset {path}')
+
+        # the images we edit are rgb, so the assets are kept in rgba, 
+        # premultiplied by alpha so that blending and resizing treat 
+        # partially transparent pixels correctly
+        image = cv2.cvtColor(image, cv2.COLOR_BGRA2RGBA)
+        image = premultiply(image)
+
+        return CachedAsset(image, cfg.asset_mip_min_side)
+
+    def evict(self):
+        """
+        Drop the least recently used assets until the store fits in max_bytes
+        (the most recent one is always kept)
+        """
+        # flipped pyramids are added after insertion, so sizes are recomputed
+        self.nbytes = sum(asset.nbytes for asset in self.assets.values())
+        while len(self.assets) > 1 and self.nbytes > self.max_bytes:
+            _, asset = self.assets.popitem(last = False)
+            self.nbytes -= asset.nbytes
+
+    def preload(self, paths):
+        """
+        Decode all the assets in paths
+        """
+        for path in paths:
+            self.get(path)
+
+    def clear(self):
+        with self.lock:
+            self.assets.clear()
+            self.nbytes = 0
+
+    def stats(self):
+        with self.lock:
+            self.evict()
+            return {'hits': self.hits, 'misses': self.misses, 
+                    'assets': len(self.assets), 'bytes': self.nbytes}
+
+# store shared by the whole process
+asset_store = AssetStore(cfg.asset_cache_bytes)
+
+def get_asset(path):
+    """
+    Return the decoded asset in path from the process-wide store
+    """
+    return asset_store.get(path)
+
+def preload_assets():
+    """
+    Decode all the assets used by the meme maker
+    """
+    asset_store.preload(cfg.meme_face_assets + cfg.eye_assets + cfg.hat_assets)
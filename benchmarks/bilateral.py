@@ -0,0 +1,70 @@
+"""
+Benchmark: time of the bilateral filter modes (filters.bilateralFilter) and
+their PSNR against the exact Cython kernel, for several sigmas
+
+Run from the project directory:
+    python benchmarks/bilateral.py --image Original_Images/daenerys.jpg --sigma_s 2 5 10 --sigma_b 10 30
+    python benchmarks/bilateral.py --megapixels 12 --sigma_s 1 2 --sigma_b 30
+The Cython kernels use OpenMP, set OMP_NUM_THREADS to measure their scaling
+"""
+
+import argparse
+import os
+import sys
+import time
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import filters
+
+MODES = ['tiled', 'separable', 'grid']
+
+def psnr(a, b):
+    mse = np.mean((a.astype(np.float64) - b.astype(np.float64)) ** 2)
+    if mse == 0:
+        return float('inf')
+    return 10 * np.log10(255 ** 2 / mse)
+
+def timed(fn, repeat):
+    best, result = float('inf'), None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--image', default = 'Original_Images/daenerys.jpg')
+    parser.add_argument('--max_side', type = int, default = 512, help = 'downscale the image so that the exact kernel stays fast')
+    parser.add_argument('--megapixels', type = float, default = None, help = 'resize the image to this size instead (overrides max_side)')
+    parser.add_argument('--sigma_s', type = int, nargs = '+', default = [2, 5, 10])
+    parser.add_argument('--sigma_b', type = int, nargs = '+', default = [10, 30])
+    parser.add_argument('--modes', nargs = '+', default = MODES)
+    parser.add_argument('--repeat', type = int, default = 1)
+    args = parser.parse_args()
+
+    img = cv2.cvtColor(cv2.imread(args.image), cv2.COLOR_BGR2RGB)
+    if args.megapixels is not None:
+        scale = np.sqrt(args.megapixels * 1e6 / (img.shape[0] * img.shape[1]))
+        img = cv2.resize(img, None, fx = scale, fy = scale, interpolation = cv2.INTER_CUBIC)
+    elif args.max_side / max(img.shape[:2]) < 1:
+        scale = args.max_side / max(img.shape[:2])
+        img = cv2.resize(img, None, fx = scale, fy = scale, interpolation = cv2.INTER_AREA)
+    print(f'image {img.shape[1]}x{img.shape[0]}')
+    out = np.empty_like(img) # reused by every run
+
+    print(f'{"sigma_s":>7} {"sigma_b":>7} {"mode":>10} {"seconds":>9} {"speedup":>8} {"psnr dB":>8}')
+    for sigma_s in args.sigma_s:
+        for sigma_b in args.sigma_b:
+            exact_time, exact = timed(lambda: filters.bilateralFilter(img, sigma_s, sigma_b, mode = 'exact'), args.repeat)
+            print(f'{sigma_s:>7} {sigma_b:>7} {"exact":>10} {exact_time:>9.3f} {1:>8.1f} {"-":>8}')
+
+            for mode in args.modes:
+                mode_time, result = timed(lambda: filters.bilateralFilter(img, sigma_s, sigma_b, mode = mode, out = out), args.repeat)
+                print(f'{sigma_s:>7} {sigma_b:>7} {mode:>10} {mode_time:>9.3f} '
+                      f'{exact_time / mode_time:>8.1f} {psnr(result, exact):>8.2f}')
+
+if __name__ == '__main__':
+    main()
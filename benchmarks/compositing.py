@@ -0,0 +1,59 @@
+"""
+Benchmark: binary alpha compositing with np.where (the previous overlay_image)
+against the premultiplied fixed-point "over" kernel (meme_maker.blend_asset)
+
+Run from the project directory:
+    python benchmarks/compositing.py --size 500 1000 2000
+"""
+
+import argparse
+import os
+import sys
+import time
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from asset_store import get_asset
+from meme_maker import blend_asset
+
+def where_blend(img_crop, asset):
+    """
+    The previous blending: float64 asset, 3 channel alpha, binary test
+    """
+    asset = asset.astype(np.float64)
+    alpha = asset[:, :, 3]
+    alpha = cv2.merge([alpha, alpha, alpha])
+    front = asset[:, :, 0:3]
+    return np.where(alpha == (0, 0, 0), img_crop, front)
+
+def timed(fn, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--asset', default = 'assets/ww.png')
+    parser.add_argument('--size', type = int, nargs = '+', default = [500, 1000, 2000])
+    parser.add_argument('--repeat', type = int, default = 5)
+    args = parser.parse_args()
+
+    cached = get_asset(args.asset)
+    straight = cv2.cvtColor(cv2.imread(args.asset, cv2.IMREAD_UNCHANGED), cv2.COLOR_BGRA2RGBA)
+
+    print(f'{"box":>12}{"np.where":>12}{"premultiplied":>16}{"speedup":>10}')
+    for size in args.size:
+        img = np.random.default_rng(0).integers(0, 256, (size, size, 3), dtype = np.uint8)
+        premultiplied = cached.resize((size, size))
+        resized = cv2.resize(straight, (size, size))
+
+        old = timed(lambda: where_blend(img, resized), args.repeat)
+        new = timed(lambda: blend_asset(img.copy(), premultiplied, 0, 0), args.repeat)
+        print(f'{f"{size}x{size}":>12}{old * 1000:10.1f}ms{new * 1000:14.1f}ms{old / new:9.1f}x')
+
+if __name__ == '__main__':
+    main()
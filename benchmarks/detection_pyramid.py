@@ -0,0 +1,109 @@
+"""
+Benchmark: latency and recall of the downscaled (pyramid) face detection
+against full-resolution detection on the images in Original_Images/
+
+The example images are small, so they are upscaled by --upscale to simulate
+phone photos. The reference boxes are the ones found on the image at its
+native size (scaled by --upscale), recall is the fraction of reference boxes
+matched by a box of the same type with IoU >= 0.5.
+
+Run from the project directory:
+    python benchmarks/detection_pyramid.py --upscale 4 --max-side 640 1024 1600
+"""
+
+import argparse
+import glob
+import os
+import sys
+import threading
+import time
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import config as cfg
+from detection import detect_faces, to_gray, get_pool
+from cascades import registry
+
+def iou(a, b):
+    """
+    Intersection over union of two (x, y, w, h) boxes
+    """
+    x1, y1 = max(a[0], b[0]), max(a[1], b[1])
+    x2, y2 = min(a[0] + a[2], b[0] + b[2]), min(a[1] + a[3], b[1] + b[3])
+    inter = max(0, x2 - x1) * max(0, y2 - y1)
+    return inter / (a[2] * a[3] + b[2] * b[3] - inter)
+
+def matched(reference, found, threshold = 0.5):
+    """
+    Number of reference boxes matched by a found box
+    """
+    return sum(any(iou(r, f) >= threshold for f in found) for r in reference)
+
+def warm_pool():
+    """
+    Load the cascades in every thread of the detection pool: the registry keeps
+    one set of cascades per thread, and the cascades run on the pool threads
+    """
+    workers = cfg.detection_workers
+    barrier = threading.Barrier(workers) # one task per thread: none returns before all started
+
+    def preload():
+        registry.preload()
+        barrier.wait()
+
+    for future in [get_pool().submit(preload) for _ in range(workers)]:
+        future.result()
+
+def timed(gray, repeat, **params):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        faces = detect_faces(gray, **params)
+        best = min(best, time.perf_counter() - start)
+    return best, faces
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--upscale', type = float, default = 4)
+    parser.add_argument('--max-side', type = int, nargs = '+', default = [640, 1024, 1600])
+    parser.add_argument('--repeat', type = int, default = 3)
+    args = parser.parse_args()
+
+    warm_pool() # exclude xml parsing from the timings
+
+    modes = [('full', {})]
+    for max_side in args.max_side:
+        modes.append((f'{max_side}', {'max_side': max_side}))
+        modes.append((f'{max_side}+refine', {'max_side': max_side, 'refine': True}))
+
+    totals = {name: [0.0, 0] for name, _ in modes}
+    num_reference = 0
+
+    print(f'{"image":<20}{"size":>12}  ' + ''.join(f'{name:>16}' for name, _ in modes))
+    for file in sorted(glob.glob('Original_Images/*')):
+        img = cv2.cvtColor(cv2.imread(file), cv2.COLOR_BGR2RGB)
+        reference = [np.asarray(f).reshape(-1, 4) * args.upscale for f in detect_faces(to_gray(img))]
+        num_reference += sum(len(f) for f in reference)
+
+        img = cv2.resize(img, None, fx = args.upscale, fy = args.upscale, interpolation = cv2.INTER_CUBIC)
+        gray = to_gray(img)
+
+        row = []
+        for name, params in modes:
+            elapsed, faces = timed(gray, args.repeat, **params)
+            hits = sum(matched(r, f) for r, f in zip(reference, faces))
+            totals[name][0] += elapsed
+            totals[name][1] += hits
+            row.append(f'{elapsed * 1000:8.0f}ms {hits:>2}/{sum(len(f) for f in reference):<2}')
+
+        print(f'{os.path.basename(file):<20}{f"{gray.shape[1]}x{gray.shape[0]}":>12}  ' + ''.join(f'{r:>16}' for r in row))
+
+    print()
+    print(f'{"mode":<16}{"total":>10}{"speedup":>10}{"recall":>10}')
+    full_time = totals['full'][0]
+    for name, (elapsed, hits) in totals.items():
+        print(f'{name:<16}{elapsed:9.2f}s{full_time / elapsed:9.1f}x{hits / max(1, num_reference):10.2f}')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+"""
+Benchmark: peak memory (RSS) and time of the brightness, contrast and grayscale 
+filters on a large image, for the previous uint32 implementations and the
+current uint8 ones (with and without out=)
+
+Every measurement runs in a fresh process, since the peak RSS of a process
+never goes down. Run from the project directory:
+    python benchmarks/filters_memory.py --megapixels 50
+"""
+
+import argparse
+import os
+import resource
+import subprocess
+import sys
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+def old_brightness(factor, img):
+    image = np.array(img, copy=True).astype(np.int64) # uint32 in the original, which overflows for factor < 0 on numpy 2
+    image = image + factor
+    image = np.clip(image, 0, 255)
+    return image.astype(np.uint8)
+
+def old_contrast(factor, img):
+    image = np.array(img, copy=True).astype(np.uint32)
+    image = image * factor
+    image = np.clip(image, 0, 255)
+    return image.astype(np.uint8)
+
+def old_grayscale(checker, img):
+    image = np.array(img, copy = True).astype(np.uint8)
+    image[:, :, 0] = image[:, :, 1] = image[:, :, 2] = \
+        0.2126 * image[:, :, 0] + 0.7152 * image[:, :, 1] + 0.0722*image[:, :, 1]
+    return image
+
+def run(variant, name, megapixels):
+    """
+    Measure one filter in this process, print 'peak_mb seconds'
+    """
+    import filters
+
+    side = int(np.sqrt(megapixels * 1e6 / 1.5))
+    img = np.full((side, int(side * 1.5), 3), 100, dtype = np.uint8)
+
+    calls = {
+        ('old', 'brightness'): lambda: old_brightness(-20, img),
+        ('old', 'contrast'): lambda: old_contrast(1.3, img),
+        ('old', 'grayscale'): lambda: old_grayscale(True, img),
+        ('new', 'brightness'): lambda: filters.adjustBrightness(-20, img),
+        ('new', 'contrast'): lambda: filters.adjustContrast(1.3, img),
+        ('new', 'grayscale'): lambda: filters.grayscaleImage(True, img),
+        ('new out=img', 'brightness'): lambda: filters.adjustBrightness(-20, img, out = img),
+        ('new out=img', 'contrast'): lambda: filters.adjustContrast(1.3, img, out = img),
+        ('new out=img', 'grayscale'): lambda: filters.grayscaleImage(True, img, out = img),
+    }
+
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    calls[(variant, name)]()
+    elapsed = time.perf_counter() - start
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    print((peak - before) / 1024, elapsed) # ru_maxrss is in KB on linux
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--megapixels', type = float, default = 50)
+    parser.add_argument('--run', nargs = 2)
+    args = parser.parse_args()
+
+    if args.run:
+        run(*args.run, args.megapixels)
+        return
+
+    print(f'{args.megapixels:.0f} MP rgb image ({args.megapixels * 3:.0f} MB)')
+    print(f'{"filter":<12}{"variant":<14}{"extra peak RSS":>16}{"time":>10}')
+    for name in ['brightness', 'contrast', 'grayscale']:
+        for variant in ['old', 'new', 'new out=img']:
+            result = subprocess.run([sys.executable, __file__, '--megapixels', str(args.megapixels), '--run', variant, name],
+                                    capture_output = True, text = True, check = True)
+            peak, elapsed = map(float, result.stdout.split()[-2:])
+            print(f'{name:<12}{variant:<14}{peak:13.0f} MB{elapsed * 1000:8.0f}ms')
+
+if __name__ == '__main__':
+    main()
@@ -4,6 +4,7 @@ from cython.parallel import parallel
 
 from libc.math cimport exp   
 from libc.math cimport sqrt
+from libc.stdlib cimport abs
 from math import pi as pi
 import numpy as np
 ctypedef unsigned char uint8_t
@@ -33,7 +34,7 @@ def bilateralFilterFast(uint8_t[:, :, :] img, uint8_t sigma_s, uint8_t sigma_b):
     # dim = 2 * k + 1 -> k = (dim - 1) / 2
     cdef int k = int((dim - 1) / 2)
 
-    # compute gaussian offline
+    # compute spatial weights offline
     cdef float[:, :] gaussian = np.zeros((dim, dim), dtype = np.float32)
 
     # norm factor for spatial gaussian
@@ -43,13 +44,22 @@ def bilateralFilterFast(uint8_t[:, :, :] img, uint8_t sigma_s, uint8_t sigma_b):
     cdef float wb = 1 / (sqrt(2 * pi) * sigma_b)
     cdef float wsb, wt
 
+    # range weights exp(-dif^2 / (2 * sigma_b^2)) for every channel difference dif in [0, 255]
+    cdef float[:] brightness = np.zeros(256, dtype = np.float32)
+
     # iterators
     cdef int i, j, h, w, x, y
 
-    # compute gaussian (m^2 + n^2) / (2 * sigma_s^2)
+    # compute gaussian ws * wb * exp(-(m^2 + n^2) / (2 * sigma_s^2))
+    # the weight exp(-1/2 ((m^2+n^2)/sigma_s^2 + (dif_r^2 + dif_g^2 + dif_b^2)/sigma_b^2)) is separable:
+    # it is the product of this spatial weight and of the range weights of the three channels,
+    # so the loop below only needs table lookups and no exp
     for i in range(-k, k+1):
         for j in range(-k, k+1):
-            gaussian[i+k, j+k] = (sqr(i) + sqr(j)) / (2 * sigma_s ** 2)
+            gaussian[i+k, j+k] = ws * wb * exp(- (sqr(i) + sqr(j)) / (2 * sigma_s ** 2))
+
+    for i in range(256):
+        brightness[i] = exp(- sqr(i) / (2 * sigma_b ** 2))
 
     # openmp for faster computation
     with nogil, parallel():
@@ -74,8 +84,8 @@ def bilateralFilterFast(uint8_t[:, :, :] img, uint8_t sigma_s, uint8_t sigma_b):
                         img_b = img[x, y, 2]
 
                         # ws * wb * exp(-1/2 ( (m^2+n^2)/sigma_s^2 + ( dif_r^2 + dif_g^2 + dif_b^2)/sigma_b^2))
-                        # (m^2 + n^2)/(2 * sigma_s^2) is the gaussian computed above
-                        wt = ws * wb * exp(- (gaussian[i+k, j+k] + (sqr(img_r - center_r) + sqr(img_g - center_g) + sqr(img_b - center_b)) / (2 * sigma_b**2)))
+                        # as the product of the tables computed above
+                        wt = gaussian[i+k, j+k] * brightness[abs(img_r - center_r)] * brightness[abs(img_g - center_g)] * brightness[abs(img_b - center_b)]
                         img_filtered[h, w, 0] += img_r * wt
                         img_filtered[h, w, 1] += img_g * wt
                         img_filtered[h, w, 2] += img_b * wt
@@ -90,6 +100,208 @@ def bilateralFilterFast(uint8_t[:, :, :] img, uint8_t sigma_s, uint8_t sigma_b):
 
     return img_filtered
 
+@cython.boundscheck(False)
+@cython.wraparound(False)
+@cython.cdivision(True)
+def bilateralFilterTiled(uint8_t[:, :, ::1] img, float sigma_s, uint8_t sigma_b, out = None, int tile = 64):
+    """
+    Same filter as bilateralFilterFast, computed tile by tile: each thread takes a 
+    tile x tile block of the output, whose input (the block and a halo of k pixels 
+    around it) stays in the cache while the kernel slides over it
+    The sums are kept in local variables and the result is written as uint8
+    (truncated, as the float32 output of bilateralFilterFast is by astype)
+    directly in out, a H x W x 3 uint8 buffer that must not overlap img, allocated if None
+    sigma_s may be fractional (e.g. scaled for a downscaled preview)
+    """
+    cdef int H = img.shape[0]
+    cdef int W = img.shape[1]
+
+    # tile divides the tile indices with C division (a zero tile is not a python error)
+    if tile < 1:
+        raise ValueError(f'tile must be at least 1, got {tile}')
+    out = checkBuffers(np.asarray(img), out)
+
+    cdef uint8_t[:, :, :] img_filtered = out
+    cdef uint8_t *row
+
+    # window and weight tables, as in bilateralFilterFast
+    cdef int dim = int(2 * pi * sigma_s)
+    if dim % 2 == 0:
+        dim += 1
+    cdef int k = int((dim - 1) / 2)
+
+    cdef float ws = 1 / (2 * pi * sigma_s ** 2) 
+    cdef float wb = 1 / (sqrt(2 * pi) * sigma_b)
+    cdef float[:, :] gaussian = np.zeros((dim, dim), dtype = np.float32)
+    cdef float[:] brightness = np.zeros(256, dtype = np.float32)
+
+    cdef int i, j, h, w, x, y, t
+    for i in range(-k, k+1):
+        for j in range(-k, k+1):
+            gaussian[i+k, j+k] = ws * wb * exp(- (sqr(i) + sqr(j)) / (2 * sigma_s ** 2))
+
+    for i in range(256):
+        brightness[i] = exp(- sqr(i) / (2 * sigma_b ** 2))
+
+    # tiles in row major order
+    cdef int tiles_x = (W + tile - 1) // tile
+    cdef int tiles = tiles_x * ((H + tile - 1) // tile)
+    cdef int h0, w0, h1, w1
+    cdef uint8_t img_r, img_g, img_b, center_r, center_g, center_b
+    cdef float sum_r, sum_g, sum_b, wsb, wt
+
+    with nogil, parallel():
+        for t in prange(tiles, schedule = 'dynamic'):
+            h0 = (t // tiles_x) * tile
+            w0 = (t % tiles_x) * tile
+            h1 = min(h0 + tile, H)
+            w1 = min(w0 + tile, W)
+
+            for h in range(h0, h1):
+                for w in range(w0, w1):
+                    center_r = img[h, w, 0]
+                    center_g = img[h, w, 1]
+                    center_b = img[h, w, 2]
+                    sum_r = 0
+                    sum_g = 0
+                    sum_b = 0
+                    wsb = 0
+
+                    for i in range(-k, k+1):
+                        # border rows are repeated, as in bilateralFilterFast
+                        x = min(max(0, h + i), H - 1)
+                        row = &img[x, 0, 0]
+
+                        for j in range(-k, k+1):
+                            y = 3 * min(max(0, w + j), W - 1)
+
+                            img_r = row[y]
+                            img_g = row[y + 1]
+                            img_b = row[y + 2]
+
+                            wt = gaussian[i+k, j+k] * brightness[abs(img_r - center_r)] * brightness[abs(img_g - center_g)] * brightness[abs(img_b - center_b)]
+                            sum_r = sum_r + img_r * wt
+                            sum_g = sum_g + img_g * wt
+                            sum_b = sum_b + img_b * wt
+                            wsb = wsb + wt
+
+                    # 1e-9 add for numerical stability, the results are at most 255
+                    wsb = wsb + 1e-9
+                    img_filtered[h, w, 0] = <uint8_t> (sum_r / wsb)
+                    img_filtered[h, w, 1] = <uint8_t> (sum_g / wsb)
+                    img_filtered[h, w, 2] = <uint8_t> (sum_b / wsb)
+
+    return out
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def bilateralFilterSeparable(uint8_t[:, :, :] img, float sigma_s, uint8_t sigma_b, out = None):
+    """
+    Approximate bilateral filter as a horizontal 1D bilateral pass followed by a
+    vertical one, O(k) per pixel instead of O(k^2) (k = pi * sigma_s)
+    Error bound: each pass gives, per channel, a convex combination of the values
+    in its 1D window (the intermediate image is rounded, which keeps it between 
+    them), so every output channel lies between the min and the max of that channel 
+    in the (2k+1)^2 window, as the exact result does: the error per channel is
+    at most the local range max - min of the window (0 in flat regions, large only
+    across edges, where the 1D passes let some colour leak around corners), plus
+    one level from the final truncation
+    out: H x W x 3 uint8 buffer that must not overlap img, allocated if None
+    sigma_s may be fractional
+    """
+    cdef int H = img.shape[0]
+    cdef int W = img.shape[1]
+
+    # checked before the passes, which write without bounds checks
+    out = checkBuffers(np.asarray(img), out)
+
+    # same window as bilateralFilterFast
+    cdef int dim = int(2 * pi * sigma_s)
+    if dim % 2 == 0:
+        dim += 1
+    cdef int k = int((dim - 1) / 2)
+
+    # 1D weights (the norm factors cancel out in the normalization)
+    cdef float[:] gaussian = np.zeros(dim, dtype = np.float32)
+    cdef float[:] brightness = np.zeros(256, dtype = np.float32)
+    cdef int i
+    for i in range(-k, k+1):
+        gaussian[i+k] = exp(- sqr(i) / (2 * sigma_s ** 2))
+
+    for i in range(256):
+        brightness[i] = exp(- sqr(i) / (2 * sigma_b ** 2))
+
+    # horizontal pass, then vertical pass on the transposed views
+    tmp = np.empty((H, W, 3), dtype = np.uint8)
+    bilateralPass(img, tmp, gaussian, brightness, k, 0)
+    bilateralPass(np.asarray(tmp).transpose(1, 0, 2), np.asarray(out).transpose(1, 0, 2), gaussian, brightness, k, 1)
+
+    return out
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+@cython.cdivision(True)
+cdef void bilateralPass(uint8_t[:, :, :] src, uint8_t[:, :, :] dst, float[:] gaussian, float[:] brightness, int k, bint truncate):
+    """
+    1D bilateral filter along the rows of src, into dst
+    truncate: truncate the result (as bilateralFilterFast's astype), otherwise round it
+    """
+    cdef int H = src.shape[0]
+    cdef int W = src.shape[1]
+    cdef int h, w, j, y
+    cdef uint8_t img_r, img_g, img_b, center_r, center_g, center_b
+    cdef float sum_r, sum_g, sum_b, wsb, wt
+    cdef float bias = 0 if truncate else 0.5
+
+    with nogil, parallel():
+        for h in prange(H, schedule = 'guided'):
+            for w in range(W):
+                center_r = src[h, w, 0]
+                center_g = src[h, w, 1]
+                center_b = src[h, w, 2]
+                sum_r = 0
+                sum_g = 0
+                sum_b = 0
+                wsb = 0
+
+                for j in range(-k, k+1):
+                    # border pixels are repeated
+                    y = min(max(0, w + j), W - 1)
+
+                    img_r = src[h, y, 0]
+                    img_g = src[h, y, 1]
+                    img_b = src[h, y, 2]
+
+                    wt = gaussian[j+k] * brightness[abs(img_r - center_r)] * brightness[abs(img_g - center_g)] * brightness[abs(img_b - center_b)]
+                    sum_r = sum_r + img_r * wt
+                    sum_g = sum_g + img_g * wt
+                    sum_b = sum_b + img_b * wt
+                    wsb = wsb + wt
+
+                # the center weight is 1, so wsb >= 1
+                dst[h, w, 0] = <uint8_t> (sum_r / wsb + bias)
+                dst[h, w, 1] = <uint8_t> (sum_g / wsb + bias)
+                dst[h, w, 2] = <uint8_t> (sum_b / wsb + bias)
+
+def checkBuffers(img, out):
+    """
+    Check the buffers of the kernels that write out without bounds checks:
+    img must be H x W x 3 and out a H x W x 3 uint8 array not overlapping img
+    Returns out, allocated if None
+    """
+    if img.ndim != 3 or img.shape[2] != 3:
+        raise ValueError(f'img must be H x W x 3, got shape {img.shape}')
+
+    H, W = img.shape[0], img.shape[1]
+    if out is None:
+        return np.empty((H, W, 3), dtype = np.uint8)
+
+    if not isinstance(out, np.ndarray) or out.shape != (H, W, 3) or out.dtype != np.uint8:
+        raise ValueError(f'out must be a {H} x {W} x 3 uint8 array')
+    if np.shares_memory(out, img):
+        raise ValueError('out must not overlap img')
+    return out
+
 cdef inline float sqr(float x) nogil:
     return x * x
 
@@ -0,0 +1,111 @@
+"""
+Fast approximate bilateral filter with a bilateral grid (Paris and Durand):
+the image is splatted into a coarse (y, x, intensity) grid, the grid is blurred
+and the result is sliced back with trilinear interpolation. The cost depends
+on the image size and on the grid size, which shrinks as sigma_s grows, instead
+of on the (2 pi sigma_s)^2 window of the exact filter
+"""
+
+import numpy as np
+import cv2
+from color_cube import lerp
+
+def bilateralGrid(img, sigma_s, sigma_b, min_range_sampling = 4, max_cells = 1 << 23, chunk = 1 << 18):
+    """
+    Approximate bilateral filter of an rgb uint8 image
+    sigma_s: spatial sigma (pixels), sigma_b: range sigma (intensity levels)
+    The range distance is measured on the luminance of the image (the exact
+    filter uses the rgb distance), so edges between colours of equal
+    luminance are smoothed
+    min_range_sampling: smallest range cell (intensity levels), which bounds
+    the grid depth for small sigma_b
+    max_cells: bound on the grid size, reached by using spatial cells larger
+    than sigma_s for small sigma_s on large images
+    """
+    H, W = img.shape[:2]
+    guide = cv2.cvtColor(img, cv2.COLOR_RGB2GRAY).astype(np.float32)
+
+    # one cell per sigma (or larger spatial cells if the grid would exceed max_cells),
+    # blurring the grid with a gaussian of sigma = 1 cell then approximates the
+    # spatial and the range gaussians
+    pad = 2 # empty cells around the grid, so that the blur has no borders
+    sampling_r = max(float(sigma_b), float(min_range_sampling))
+    gd = int(np.ceil(255 / sampling_r)) + 1 + 2 * pad
+    sampling_s = max(float(sigma_s), 1.0, np.sqrt(H * W * gd / max_cells))
+
+    # sigmas in cells
+    blur_s = sigma_s / sampling_s
+    blur_r = sigma_b / sampling_r
+
+    gh = int(np.ceil((H - 1) / sampling_s)) + 1 + 2 * pad
+    gw = int(np.ceil((W - 1) / sampling_s)) + 1 + 2 * pad
+
+    # splat: every pixel adds its colour and a weight of 1 to its nearest cell
+    gy = np.rint(np.arange(H) / sampling_s).astype(np.int64) + pad
+    gx = np.rint(np.arange(W) / sampling_s).astype(np.int64) + pad
+    cells = np.rint(guide / sampling_r).astype(np.int64)
+    cells += pad + ((gy[:, None] * gw + gx[None, :]) * gd)
+    cells = cells.ravel()
+
+    grid = np.empty((gh, gw, gd, 4), dtype = np.float32)
+    pixels = img.reshape(-1, 3)
+    for c in range(3):
+        grid[..., c] = np.bincount(cells, weights = pixels[:, c], minlength = gh * gw * gd).reshape(gh, gw, gd)
+    grid[..., 3] = np.bincount(cells, minlength = gh * gw * gd).reshape(gh, gw, gd)
+    del cells
+
+    # blur: spatially with one opencv call (grid depth and channels as image channels,
+    # at most 4 * 69 < 512 of them), then along the range axis
+    grid = cv2.GaussianBlur(grid.reshape(gh, gw, gd * 4), (5, 5), blur_s, borderType = cv2.BORDER_CONSTANT)
+    grid = blur_axis(grid.reshape(gh, gw, gd, 4), blur_r, axis = 2)
+
+    # slice: trilinear interpolation of the grid at every pixel
+    out = np.empty_like(img)
+    table = grid.reshape(-1, 4)
+    zs = guide.ravel()
+    dst = out.reshape(-1, 3)
+
+    for start in range(0, H * W, chunk):
+        index = np.arange(start, min(start + chunk, H * W))
+        y = (index // W).astype(np.float32) / sampling_s + pad
+        x = (index % W).astype(np.float32) / sampling_s + pad
+        z = zs[start:start + chunk] / sampling_r + pad
+
+        y0, x0, z0 = y.astype(np.int64), x.astype(np.int64), z.astype(np.int64)
+        fy, fx, fz = (y - y0)[:, None], (x - x0)[:, None], (z - z0)[:, None]
+
+        base = (y0 * gw + x0) * gd + z0
+        dy, dx = gw * gd, gd
+        c00 = lerp(table[base], table[base + 1], fz)
+        c01 = lerp(table[base + dx], table[base + dx + 1], fz)
+        c10 = lerp(table[base + dy], table[base + dy + 1], fz)
+        c11 = lerp(table[base + dy + dx], table[base + dy + dx + 1], fz)
+        result = lerp(lerp(c00, c01, fx), lerp(c10, c11, fx), fy)
+
+        # normalize by the accumulated weight
+        colour = result[:, 0:3] / np.maximum(result[:, 3:4], 1e-6)
+        dst[start:start + chunk] = np.clip(colour + 0.5, 0, 255)
+
+    return out
+
+def blur_axis(grid, sigma, axis):
+    """
+    Gaussian blur of grid along one axis (sigma in cells), zero outside the grid
+    """
+    if sigma <= 0:
+        return grid
+
+    radius = max(1, int(np.ceil(2 * sigma)))
+    taps = np.arange(-radius, radius + 1)
+    kernel = np.exp(-taps ** 2 / (2 * sigma ** 2))
+    kernel /= kernel.sum()
+
+    padded = np.moveaxis(grid, axis, 0)
+    blurred = np.zeros_like(padded)
+    n = padded.shape[0]
+    for tap, weight in zip(taps, kernel):
+        # blurred[i] += weight * padded[i + tap]
+        lo, hi = max(0, -tap), min(n, n - tap)
+        blurred[lo:hi] += weight * padded[lo + tap:hi + tap]
+
+    return np.moveaxis(blurred, 0, axis)
@@ -0,0 +1,71 @@
+"""
+Registry of Haar cascades, so that the xml files are parsed once
+instead of on every detection call
+"""
+
+import threading
+import time
+import cv2
+import config as cfg
+
+class CascadeRegistry:
+    """
+    Lazily loads cascade classifiers by name and keeps one instance per thread
+    (a CascadeClassifier must not be shared between threads)
+    """
+    def __init__(self, files):
+        self.files = dict(files) # cascade name -> xml path
+        self.local = threading.local() # per thread cascades
+        self.lock = threading.Lock()
+        self.load_times = {} # cascade name -> list of load times (sec), one per thread
+
+    def get(self, name):
+        """
+        Return the cascade with the given name for the calling thread,
+        loading it from its xml file the first time it is requested
+        """
+        cascades = getattr(self.local, 'cascades', None)
+        if cascades is None:
+            cascades = self.local.cascades = {}
+
+        cascade = cascades.get(name)
+        if cascade is None:
+            if name not in self.files:
+                raise KeyError(f'Unknown cascade: {name}')
+
+            start = time.perf_counter()
+            cascade = cv2.CascadeClassifier(self.files[name])
+            elapsed = time.perf_counter() - start
+
+            if cascade.empty():
+                raise IOError(f'Could not load cascade {name} from {self.files[name]}')
+
+            cascades[name] = cascade
+            with self.lock:
+                self.load_times.setdefault(name, []).append(elapsed)
+
+        return cascade
+
+    def preload(self, names = None):
+        """
+        Load the cascades in names (all of them if None) for the calling thread
+        """
+        for name in (self.files if names is None else names):
+            self.get(name)
+
+    def stats(self):
+        """
+        Number of loads and total load time (sec) for each cascade
+        """
+        with self.lock:
+            return {name: {'loads': len(times), 'load_time': sum(times)} 
+                    for name, times in self.load_times.items()}
+
+# registry shared by the whole process
+registry = CascadeRegistry(cfg.cascade_files)
+
+def get_cascade(name):
+    """
+    Return the cascade with the given name from the process-wide registry
+    """
+    return registry.get(name)
@@ -0,0 +1,113 @@
+"""
+3D colour lookup tables: any per-pixel colour transformation (hue, saturation,
+brightness, ...) is baked into a small rgb cube and applied with trilinear
+interpolation, so the same colour grade can be applied to many images
+without running the transformation itself
+"""
+
+import numpy as np
+import cv2
+
+class ColorCube:
+    """
+    size x size x size lattice of output colours, indexed by the input (r, g, b)
+    The lattice points are the uint8 values round(255 * i / (size - 1))
+    """
+    def __init__(self, table):
+        self.size = table.shape[0]
+        self.table = np.ascontiguousarray(table, dtype = np.float32).reshape(-1, 3)
+        self.grid = np.round(np.linspace(0, 255, self.size)).astype(np.int64)
+
+        # for every uint8 value: the lattice cell it falls in and its position in the cell,
+        # so that interpolation only needs table lookups (the lattice may be non uniform)
+        values = np.arange(256)
+        self.cell = np.clip(np.searchsorted(self.grid, values, side = 'right') - 1, 0, self.size - 2)
+        low, high = self.grid[self.cell], self.grid[self.cell + 1]
+        self.frac = ((values - low) / (high - low)).astype(np.float32)
+        self.full = None # the cube interpolated at every colour, see lut()
+
+    @classmethod
+    def bake(cls, transform, size = 33):
+        """
+        Bake transform, a function from an rgb uint8 image to an rgb uint8 image
+        that treats every pixel independently (e.g. lambda img: changeHue(30, img)),
+        into a cube with size points per channel
+        """
+        grid = np.round(np.linspace(0, 255, size)).astype(np.uint8)
+        r, g, b = np.meshgrid(grid, grid, grid, indexing = 'ij')
+
+        # the lattice as a (size * size) x size image
+        lattice = np.stack([r, g, b], axis = -1).reshape(size * size, size, 3)
+        table = np.asarray(transform(lattice)).reshape(size, size, size, 3)
+        return cls(table)
+
+    def lut(self):
+        """
+        The cube interpolated at every uint8 colour: a 256^3 table (64 MB, computed on
+        first use) of the output colours packed as little endian uint32 (r, g, b, 0),
+        indexed by (r << 16) | (g << 8) | b
+        Trilinear interpolation is separable, so it is computed one axis at a time
+        (b, then g, then r), in the same order and precision as interpolating each pixel
+        """
+        if self.full is None:
+            n = self.size
+            cube = self.table.reshape(n, n, n, 3)
+            cell, frac = self.cell, self.frac
+
+            # along b: n x n x 256, then along g: n x 256 x 256
+            cube = lerp(cube[:, :, cell], cube[:, :, cell + 1], frac[None, None, :, None])
+            cube = lerp(cube[:, cell], cube[:, cell + 1], frac[None, :, None, None])
+
+            full = np.zeros(1 << 24, dtype = '<u4')
+            packed = full.view(np.uint8).reshape(256, 256, 256, 4)
+
+            # along r, a slab of r values at a time to bound the float temporaries
+            for r in range(0, 256, 16):
+                rs = slice(r, r + 16)
+                slab = lerp(cube[cell[rs]], cube[cell[rs] + 1], frac[rs, None, None, None])
+                np.clip(slab + 0.5, 0, 255, out = slab)
+                packed[rs, :, :, 0:3] = slab
+
+            self.full = full
+        return self.full
+
+    def apply(self, img, out = None, chunk = 1 << 20):
+        """
+        Map every pixel of the rgb uint8 img (H x W x 3) through the cube (trilinear interpolation)
+        with one lookup per pixel in lut()
+        out: C contiguous H x W x 3 uint8 buffer for the result (may be img), 
+        chunk: pixels processed at a time, which bounds the temporaries
+        """
+        if out is None:
+            out = np.empty_like(img)
+        elif out.shape != img.shape or out.dtype != np.uint8 or not out.flags.c_contiguous:
+            raise ValueError('out must be a C contiguous uint8 array of the shape of img')
+
+        full = self.lut()
+        H, W = img.shape[:2]
+        rows = max(1, chunk // max(W, 1))
+
+        for start in range(0, H, rows):
+            src = img[start:start + rows]
+
+            # packed index (r << 16) | (g << 8) | b
+            index = src[:, :, 0].astype(np.uint32)
+            index <<= 8
+            index |= src[:, :, 1]
+            index <<= 8
+            index |= src[:, :, 2]
+
+            # gather the packed colours and unpack them (drop the 4th byte)
+            colours = np.take(full, index).view(np.uint8).reshape(index.shape + (4, ))
+            cv2.cvtColor(colours, cv2.COLOR_RGBA2RGB, dst = out[start:start + rows])
+
+        return out
+
+def lerp(a, b, t):
+    """
+    a + (b - a) * t, in place in a
+    """
+    b -= a
+    b *= t
+    a += b
+    return a
@@ -32,4 +32,19 @@ def hsv_to_rgb(img):
     Transform an hsv image to the rgb color space
     """
     rgb = cv2.cvtColor(img, cv2.COLOR_HSV2RGB)
-    return rgb
\ No newline at end of file
+    return rgb
+
+def hsv_adjustment_lut(hue_shift, saturation_factor):
+    """
+    Lookup table (one column per h, s, v channel) for opencv's uint8 hsv images:
+    rotates hue by hue_shift (hue is in [0, 180) and wraps around), 
+    multiplies saturation by saturation_factor (rounded, clipped to 255)
+    and leaves value unchanged
+    """
+    values = np.arange(256)
+
+    lut = np.empty((1, 256, 3), dtype = np.uint8)
+    lut[0, :, 0] = (values + int(round(hue_shift))) % 180
+    lut[0, :, 1] = np.clip(np.round(values * saturation_factor), 0, 255)
+    lut[0, :, 2] = values
+    return lut
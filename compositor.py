@@ -0,0 +1,200 @@
+"""
+Layer stack that keeps several meme assets live over a base image and
+re-renders only the regions that changed
+"""
+
+from asset_store import get_asset
+from meme_maker import face_box, fit_asset, blend_asset, clip_box
+
+class Layer:
+    """
+    An asset placed on a detection
+    asset: path of the asset (its id in the asset store)
+    detection: the (x, y, w, h) box the asset is placed on
+    place: function giving the asset bounding box from the detection, the
+    offsets and the scale (meme_maker.face_box or meme_maker.hat_box)
+    """
+    def __init__(self, asset, detection, scale = 1, offset_x = 0, offset_y = 0,
+                 flip_x = 0, flip_y = 0, place = face_box):
+        self.asset = asset
+        self.detection = detection
+        self.scale = scale
+        self.offset_x = offset_x
+        self.offset_y = offset_y
+        self.flip_x = flip_x
+        self.flip_y = flip_y
+        self.place = place
+        self.fitted = None # (key, resized asset, dx, dy) of the last fit
+
+    def box(self):
+        return self.place(self.detection, self.offset_x, self.offset_y, self.scale)
+
+    def fit(self):
+        """
+        The asset resized and flipped for the current bounding box and its position
+        (x, y) in the image, or None if the box is empty
+        Moving the layer does not resize the asset again
+        """
+        x, y, w, h = self.box()
+        key = (self.asset, w, h, bool(self.flip_x), bool(self.flip_y))
+
+        if self.fitted is None or self.fitted[0] != key:
+            resized, dx, dy = fit_asset(get_asset(self.asset), w, h, self.flip_x, self.flip_y)
+            self.fitted = (key, resized, dx, dy)
+
+        _, resized, dx, dy = self.fitted
+        if resized is None:
+            return None
+        return resized, x + dx, y + dy
+
+    def bounds(self):
+        """
+        Rectangle (x1, y1, x2, y2) covered by the asset pixels, or None
+        """
+        fitted = self.fit()
+        if fitted is None:
+            return None
+
+        resized, x, y = fitted
+        return x, y, x + resized.shape[1], y + resized.shape[0]
+
+class LayerStack:
+    """
+    Layers composited in order over a base image
+    Every change marks the rectangles it affects as dirty and render() only
+    recomputes those rectangles: the base is restored there and the layers
+    overlapping them are blended again, clipped to the rectangle
+    """
+    def __init__(self, base):
+        self.base = base
+        self.image = base.copy() # the composited image
+        self.layers = {} # layer id -> Layer, in stacking order
+        self.next_id = 0
+        self.dirty = [] # rectangles (x1, y1, x2, y2) to recompute
+        self.rendered_pixels = 0 # pixels recomputed by render() so far
+
+    def add(self, asset, detection, **params):
+        """
+        Add a layer on top of the stack and return its id
+        params: scale, offset_x, offset_y, flip_x, flip_y, place (see Layer)
+        """
+        layer = Layer(asset, detection, **params)
+        layer_id = self.next_id
+        self.next_id += 1
+
+        self.layers[layer_id] = layer
+        self.mark_dirty(layer.bounds())
+        return layer_id
+
+    def update(self, layer_id, **params):
+        """
+        Change the parameters of a layer
+        """
+        layer = self.layers[layer_id]
+        old_bounds = layer.bounds()
+
+        for name, value in params.items():
+            if not hasattr(layer, name):
+                raise AttributeError(f'Layer has no parameter {name}')
+            setattr(layer, name, value)
+
+        # the old position must be uncovered and the new one covered
+        self.mark_dirty(old_bounds)
+        self.mark_dirty(layer.bounds())
+
+    def remove(self, layer_id):
+        layer = self.layers.pop(layer_id)
+        self.mark_dirty(layer.bounds())
+
+    def set_base(self, base):
+        """
+        Replace the base image, everything is recomputed
+        """
+        if base.shape != self.base.shape:
+            self.image = base.copy()
+        self.base = base
+        H, W = base.shape[:2]
+        self.dirty = []
+        self.mark_dirty((0, 0, W, H))
+
+    def mark_dirty(self, rect):
+        """
+        Add a rectangle to the dirty ones, merging it with the ones it overlaps
+        so that no pixel is recomputed twice
+        """
+        if rect is None:
+            return
+
+        H, W = self.base.shape[:2]
+        x1, y1, x2, y2 = rect
+        rect = clip_box(x1, y1, x2 - x1, y2 - y1, H, W)
+        if rect is None:
+            return
+
+        merged = True
+        while merged:
+            merged = False
+            for other in self.dirty:
+                if rect[0] < other[2] and other[0] < rect[2] and rect[1] < other[3] and other[1] < rect[3]:
+                    self.dirty.remove(other)
+                    rect = (min(rect[0], other[0]), min(rect[1], other[1]),
+                            max(rect[2], other[2]), max(rect[3], other[3]))
+                    merged = True
+                    break
+
+        self.dirty.append(rect)
+
+    def render(self):
+        """
+        Recompute the dirty rectangles and return the composited image
+        The returned array is updated in place by later renders
+        """
+        for (x1, y1, x2, y2) in self.dirty:
+            view = self.image[y1:y2, x1:x2]
+            view[...] = self.base[y1:y2, x1:x2]
+
+            for layer in self.layers.values():
+                fitted = layer.fit()
+                if fitted is not None:
+                    resized, x, y = fitted
+                    # blend_asset clips the asset to the view
+                    blend_asset(view, resized, x - x1, y - y1)
+
+            self.rendered_pixels += (x2 - x1) * (y2 - y1)
+
+        self.dirty = []
+        return self.image
+
+    def flatten(self):
+        """
+        A copy of the composited image, with all layers baked in
+        """
+        return self.render().copy()
+
+class AssetPreview:
+    """
+    One live asset drawn over an image, as the meme maker layouts preview it:
+    when the controls change only the rectangles the asset covered and
+    covers now are recomputed, instead of copying the whole image
+    """
+    def __init__(self):
+        self.stack = None
+        self.layer = None
+
+    def render(self, img, asset, detection, **params):
+        """
+        Draw asset on detection over img and return the result
+        params: scale, offset_x, offset_y, flip_x, flip_y, place (see Layer)
+        The returned array is updated in place by later renders over the same img
+        """
+        if self.stack is None or self.stack.base is not img:
+            # new image (upload, filter, or the previous asset was committed)
+            self.stack = LayerStack(img)
+            self.layer = None
+
+        if self.layer is None:
+            self.layer = self.stack.add(asset, detection, **params)
+        else:
+            self.stack.update(self.layer, asset = asset, detection = detection, **params)
+
+        return self.stack.render()
@@ -2,6 +2,8 @@
 Configuration file
 """
 
+import os
+
 supported_types_str = 'image/png, image/jpeg, image/tiff'
 supported_types_list = ['image/png', 'image/jpeg', 'image/tiff']
 
@@ -19,4 +21,62 @@ hat_assets = ['assets/cap.png',
 geometry_assets = ['assets/eyeglasses.png',
                    'assets/glasses.png',
                    'assets/mask.png',
-                   'assets/batman.png']
\ No newline at end of file
+                   'assets/batman.png']
+
+# Haar cascades used for face and eye detection, loaded once per thread
+# by the cascade registry (cascades.py)
+cascade_files = {'frontal': 'haarcascades/haarcascade_frontalface_default.xml',
+                 'profile': 'haarcascades/haarcascade_profileface.xml',
+                 'cat': 'haarcascades/haarcascade_frontalcatface.xml',
+                 'eye': 'haarcascades/haarcascade_eye.xml'}
+
+# parameters of the face detection (see detection.detect_faces)
+# max_side: larger images are downscaled so that their longest side is max_side
+# before running the cascades (None runs them at full resolution)
+# refine: re-detect each downscaled box at full resolution
+# nms_iou: overlapping boxes with IoU above nms_iou are merged into one
+# (frontal preferred over profile over cat), None keeps every box
+# benchmarks/detection_pyramid.py shows latency and recall for these settings
+detection_params = {'scale_factor': 1.1, 'min_neighbors': 6, 
+                    'max_side': 1024, 'min_face': 0, 'refine': False, 
+                    'nms_iou': 0.3}
+
+# threads running the face cascades (and the per face eye cascades) concurrently
+detection_workers = min(4, os.cpu_count() or 1)
+
+# fraction of the face box (from the top) searched for eyes
+eye_region = 0.6
+
+# detection cache bounds (number of images and bytes of gray images kept)
+detection_cache_entries = 32
+detection_cache_bytes = 256 * 1024 * 1024
+
+# memory budget (bytes) of decoded assets kept by the asset store
+asset_cache_bytes = 128 * 1024 * 1024
+
+# assets are kept as mip pyramids, halved until the smaller side reaches this size
+asset_mip_min_side = 8
+
+# bilateral filter used by the filters layout (see filters.bilateralFilter):
+# 'exact', 'tiled' (same result, faster), 'separable' or 'grid' (fast approximations)
+# or 'auto' (tiled for small windows, separable for large ones)
+bilateral_mode = 'auto'
+
+# 'auto' switches to the separable approximation when the window 2 pi sigma_s
+# is larger than this (pixels)
+bilateral_separable_window = 30
+
+# the bilateral sliders preview the filter on a copy of the image downscaled to this 
+# longest side (sigma_s scaled with it), with bilateral_preview_mode (a mode accepting a
+# fractional sigma_s: 'tiled', 'separable', 'grid' or 'auto'); the full resolution result
+# is computed when Done is pressed
+bilateral_preview_max_side = 512
+bilateral_preview_mode = 'auto'
+
+# background bilateral previews of a full resolution image (smaller than the proxy) are computed
+# in strips of this many rows, so that a job superseded by a newer slider value stops after the current strip
+bilateral_strip_rows = 256
+
+# control changes of the editing layouts closer than this (seconds) are coalesced
+# into a single render (see events.EventCoalescer)
+render_interval = 0.05
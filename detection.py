@@ -0,0 +1,362 @@
+"""
+Shared detection pass: faces (frontal, profile, cats) and eyes are found once
+per image and reused by face_detection, eyes_detection and the layouts
+"""
+
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import cv2
+import numpy as np
+import config as cfg
+from cascades import get_cascade
+
+FACE_CASCADES = ('frontal', 'profile', 'cat') # detection and numbering order
+
+pool = None # thread pool running the cascades, created on first use
+pool_lock = threading.Lock()
+
+def get_pool():
+    """
+    Bounded thread pool shared by all detections (cfg.detection_workers threads)
+    """
+    global pool
+    with pool_lock:
+        if pool is None:
+            pool = ThreadPoolExecutor(max_workers = cfg.detection_workers, thread_name_prefix = 'detection')
+        return pool
+
+def detect_faces(gray, scale_factor = 1.1, min_neighbors = 6, max_side = None, min_face = 0, refine = False, 
+                 nms_iou = None):
+    """
+    Run the frontal, profile and cat cascades on a grayscale image
+    max_side: if set and the image is larger, the cascades run on a copy downscaled
+    so that its longest side is max_side and the boxes are mapped back to gray
+    min_face: smallest face side (in gray pixels) we care about when downscaling
+    refine: re-detect every box found on the downscaled copy in a small
+    full-resolution window around it, for pixel-accurate boxes
+    nms_iou: if set, overlapping boxes (IoU > nms_iou) found by several cascades
+    or several times by the same cascade are reduced to one (see suppress_duplicates)
+    """
+    H, W = gray.shape[:2]
+    scale = 1
+    if max_side is not None and max(H, W) > max_side:
+        scale = max_side / max(H, W)
+
+    small = gray
+    if scale != 1:
+        # INTER_AREA averages the pixels, so the small copy is not aliased
+        small = cv2.resize(gray, (max(1, round(W * scale)), max(1, round(H * scale))), interpolation = cv2.INTER_AREA)
+
+    # opencv releases the GIL during detection, so the cascades run concurrently;
+    # results are collected in FACE_CASCADES order to keep the face numbering
+    pool = get_pool()
+    futures = [pool.submit(detect_face_type, name, gray, small, scale, 
+                           scale_factor, min_neighbors, min_face, refine) 
+               for name in FACE_CASCADES]
+
+    detections = tuple(future.result() for future in futures)
+
+    if nms_iou is not None:
+        detections = suppress_duplicates(detections, nms_iou)
+
+    return detections
+
+def detect_face_type(name, gray, small, scale, scale_factor, min_neighbors, min_face, refine):
+    """
+    Run one face cascade, on small if the image was downscaled (scale != 1)
+    """
+    if scale == 1:
+        # detectMultiScale parameters: img, scaleFactor, minNeighbors
+        # scaleFactor: parameter specifying how much the image size is reduced at
+        # each image scale. The smaller the scaleFactor, the smaller the step for
+        # resizing -> + more accuracy, - slower
+        # minNeighbors: parameter specifying how many neighbors each candidate
+        # rectange should have to be called a face. Higher values give less matches
+        # of higher quality
+        return get_cascade(name).detectMultiScale(gray, scale_factor, min_neighbors)
+
+    faces = detect_downscaled(name, small, scale, scale_factor, min_neighbors, min_face)
+    if refine:
+        faces = refine_faces(name, gray, faces, scale_factor, min_neighbors)
+    return faces
+
+def detect_downscaled(name, small, scale, scale_factor, min_neighbors, min_face):
+    """
+    Run the cascade on the downscaled image small and map the boxes back
+    to the original coordinates (small = original * scale)
+    """
+    cascade = get_cascade(name)
+
+    # faces smaller than the cascade window cannot be found in small anyway,
+    # faces smaller than min_face are not searched for at all
+    win_w, win_h = cascade.getOriginalWindowSize()
+    min_size = (max(win_w, int(np.ceil(min_face * scale))), max(win_h, int(np.ceil(min_face * scale))))
+    max_size = (small.shape[1], small.shape[0])
+
+    faces = cascade.detectMultiScale(small, scale_factor, min_neighbors, minSize = min_size, maxSize = max_size)
+    if len(faces) == 0:
+        return np.empty((0, 4), dtype = np.int32)
+
+    return np.round(np.asarray(faces, dtype = np.float64) / scale).astype(np.int32)
+
+def refine_faces(name, gray, faces, scale_factor, min_neighbors, margin = 0.25):
+    """
+    Re-detect each face in a full-resolution window around its box, searching only
+    sizes close to the box size; boxes that are not found again are kept as they are
+    """
+    cascade = get_cascade(name)
+    H, W = gray.shape[:2]
+    refined = []
+
+    for (x, y, w, h) in faces:
+        # window around the box, clipped to the image
+        x1, y1 = max(0, int(x - margin * w)), max(0, int(y - margin * h))
+        x2, y2 = min(W, int(x + (1 + margin) * w)), min(H, int(y + (1 + margin) * h))
+
+        candidates = cascade.detectMultiScale(gray[y1:y2, x1:x2], scale_factor, min_neighbors,
+                                              minSize = (int(0.7 * w), int(0.7 * h)),
+                                              maxSize = (int(1.4 * w), int(1.4 * h)))
+        if len(candidates) == 0:
+            refined.append((x, y, w, h))
+            continue
+
+        # keep the candidate whose center is closest to the center of the box
+        candidates = np.asarray(candidates) + (x1, y1, 0, 0)
+        centers = candidates[:, :2] + candidates[:, 2:] / 2
+        dist = np.sum((centers - (x + w / 2, y + h / 2)) ** 2, axis = 1)
+        refined.append(tuple(candidates[np.argmin(dist)]))
+
+    return np.asarray(refined, dtype = np.int32).reshape(-1, 4)
+
+def non_max_suppression(boxes, priorities, iou_threshold):
+    """
+    Greedy non-maximum suppression of (x, y, w, h) boxes
+    Boxes are visited by priority (lower value first), then by area (larger first),
+    and every box overlapping a kept box with IoU > iou_threshold is dropped
+    Returns the indices of the kept boxes in increasing order
+    """
+    boxes = np.asarray(boxes, dtype = np.float64).reshape(-1, 4)
+    x1, y1 = boxes[:, 0], boxes[:, 1]
+    x2, y2 = x1 + boxes[:, 2], y1 + boxes[:, 3]
+    areas = boxes[:, 2] * boxes[:, 3]
+
+    # lexsort sorts by the last key first
+    order = np.lexsort((-areas, np.asarray(priorities)))
+    keep = []
+
+    while order.size > 0:
+        i = order[0]
+        keep.append(i)
+        rest = order[1:]
+
+        # IoU of box i with all the remaining boxes at once
+        inter_w = np.clip(np.minimum(x2[i], x2[rest]) - np.maximum(x1[i], x1[rest]), 0, None)
+        inter_h = np.clip(np.minimum(y2[i], y2[rest]) - np.maximum(y1[i], y1[rest]), 0, None)
+        inter = inter_w * inter_h
+        iou = inter / (areas[i] + areas[rest] - inter)
+
+        order = rest[iou <= iou_threshold]
+
+    return np.sort(np.asarray(keep, dtype = np.int64))
+
+def suppress_duplicates(detections, iou_threshold):
+    """
+    Apply non-maximum suppression to the merged (frontal, profile, cats) detections,
+    preferring frontal over profile over cat boxes
+    Returns the detections by type, each keeping its original order
+    """
+    boxes = [np.asarray(faces).reshape(-1, 4) for faces in detections]
+    types = np.concatenate([np.full(len(b), i) for i, b in enumerate(boxes)])
+    if types.size == 0:
+        return detections
+
+    merged = np.concatenate(boxes)
+    keep = non_max_suppression(merged, types, iou_threshold)
+
+    return tuple(merged[keep[types[keep] == i]].astype(np.int32) for i in range(len(boxes)))
+
+def detect_eyes(gray, faces, upper = None):
+    """
+    Look for a set of eyes inside each face box
+    Returns a list of (face, eyes) for the faces where exactly two eyes are found,
+    in the order of faces, eyes being relative to the face box
+    upper: fraction of the face box (from the top) that is searched, eyes are
+    never in the lower part (cfg.eye_region if None)
+    """
+    if upper is None:
+        upper = cfg.eye_region
+
+    # one eye cascade per face box, run concurrently; map keeps the order of faces
+    eyes_per_face = get_pool().map(detect_face_eyes, [gray] * len(faces), faces, [upper] * len(faces))
+
+    eye_sets = []
+    for face, eyes in zip(faces, eyes_per_face):
+        if len(eyes) == 2:  # if two eyes are found, consider them a valid set of eyes
+            eye_sets.append((face, list(eyes)))
+
+    return eye_sets
+
+def detect_face_eyes(gray, face, upper):
+    """
+    Run the eye cascade inside the upper part of a face box
+    """
+    (x, y, w, h) = face
+    roi_gray = gray[y:y+max(1, int(h * upper)), x:x+w]   # roi: region of interest
+
+    return get_cascade('eye').detectMultiScale(roi_gray)   # leave default parameters per opencv example
+
+class DetectionResult:
+    """
+    Detections for one image: the gray image, the faces by type and
+    (computed on first use) the sets of eyes
+    """
+    def __init__(self, gray, faces_frontal, faces_profile, cat_faces):
+        self.gray = gray
+        self.faces_frontal = faces_frontal
+        self.faces_profile = faces_profile
+        self.cat_faces = cat_faces
+        self.eye_sets = None # (eye region, eye sets), eye detection is run only when needed
+
+    @property
+    def num_faces(self):
+        return len(self.faces_frontal) + len(self.faces_profile)
+
+    @property
+    def num_cat_faces(self):
+        return len(self.cat_faces)
+
+    def faces(self):
+        """
+        All faces in the order used for numbering (frontal, profile, cats)
+        """
+        return [*self.faces_frontal, *self.faces_profile, *self.cat_faces]
+
+    def eyes(self, upper = None):
+        """
+        Eye sets for the detected faces, reusing the face boxes
+        upper: eye region searched (cfg.eye_region if None), the eyes are
+        detected again when it changes (the cache key only covers the faces)
+        """
+        if upper is None:
+            upper = cfg.eye_region
+
+        eye_sets = self.eye_sets
+        if eye_sets is None or eye_sets[0] != upper:
+            eye_sets = self.eye_sets = (upper, detect_eyes(self.gray, self.faces(), upper))
+        return eye_sets[1]
+
+def to_gray(img):
+    """
+    Gray image used by the cascades
+    """
+    # equivalent to converting to bgr and then applying COLOR_RGB2GRAY,
+    # as the detection functions always did
+    return cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+
+def detect(img, cache = None, **params):
+    """
+    Run the face cascades on an rgb image
+    params override cfg.detection_params, cache is the DetectionCache
+    to look the image up in (the process-wide one if None)
+    """
+    if cache is None:
+        cache = detection_cache
+    return cache.detect(img, **params)
+
+class DetectionCache:
+    """
+    LRU cache of DetectionResults keyed by a hash of the gray image and the
+    detector parameters, bounded by number of entries and bytes
+    """
+    def __init__(self, max_entries, max_bytes):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict() # key -> (result, size in bytes)
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def key(self, gray, params):
+        """
+        Cache key: the cascades only see the gray image, so images that differ
+        only in colour share an entry
+        """
+        digest = hashlib.blake2b(gray.data if gray.flags.c_contiguous else gray.tobytes(), 
+                                 digest_size = 16).digest()
+        return digest, gray.shape, tuple(sorted(params.items()))
+
+    def detect(self, img, **params):
+        """
+        Return the detections for img, running the cascades only on a miss
+        """
+        params = {**cfg.detection_params, **params}
+        gray = to_gray(img)
+        key = self.key(gray, params)
+
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+
+        result = DetectionResult(gray, *detect_faces(gray, **params))
+        self.put(key, result, gray.nbytes)
+        return result
+
+    def put(self, key, result, size):
+        """
+        Insert an entry and evict the least recently used ones until within bounds
+        """
+        with self.lock:
+            if key in self.entries:
+                self.nbytes -= self.entries.pop(key)[1]
+            self.entries[key] = (result, size)
+            self.nbytes += size
+
+            while self.entries and (len(self.entries) > self.max_entries or self.nbytes > self.max_bytes):
+                _, (_, evicted_size) = self.entries.popitem(last = False)
+                self.nbytes -= evicted_size
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.nbytes = 0
+
+    def stats(self):
+        """
+        Hit/miss counters and current size of the cache
+        """
+        with self.lock:
+            return {'hits': self.hits, 'misses': self.misses, 
+                    'entries': len(self.entries), 'bytes': self.nbytes}
+
+# cache shared by the whole process
+detection_cache = DetectionCache(cfg.detection_cache_entries, cfg.detection_cache_bytes)
+
+class SharedDetector:
+    """
+    Keeps the detections of the latest image, so that every layout
+    showing the same image version reuses a single detection pass;
+    other images are looked up in the detection cache (undo, filters
+    that leave the gray image unchanged, re-uploads)
+    """
+    def __init__(self, cache = None):
+        self.cache = cache
+        self.img = None
+        self.result = None
+
+    def get(self, img):
+        """
+        Return the detections for img
+        """
+        # uploads and filter commits always produce a new array, so the
+        # identity of the array is the image version and we can skip hashing
+        if img is not self.img or self.result is None:
+            self.result = detect(img, self.cache)
+            self.img = img
+        return self.result
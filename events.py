@@ -0,0 +1,97 @@
+"""
+Coalescing of the control events of the editing layouts: a burst of slider
+changes (or a reset that sets every control) results in a single render
+"""
+
+import threading
+from contextlib import contextmanager
+import config as cfg
+
+class EventCoalescer:
+    """
+    Collects render requests and runs only the latest one, at most once every
+    interval seconds (cfg.render_interval if None)
+    The render runs on a timer thread, so it must not use pyplot
+    """
+    def __init__(self, interval = None):
+        self.interval = cfg.render_interval if interval is None else interval
+        self.lock = threading.Lock()
+        self.render_lock = threading.RLock() # one render at a time
+        self.pending = None # latest requested render
+        self.timer = None
+        self.held = 0
+        self.renders = 0 # renders run
+        self.suppressed = 0 # requests replaced by a later one before they were rendered
+
+    def request(self, render):
+        """
+        Ask for render() to run; it replaces the request not rendered yet, if any
+        """
+        with self.lock:
+            if self.pending is not None:
+                self.suppressed += 1
+            self.pending = render
+
+            if self.held or self.timer is not None:
+                return
+
+            self.timer = threading.Timer(self.interval, self.tick)
+            self.timer.daemon = True
+            self.timer.start()
+
+    def tick(self):
+        with self.lock:
+            self.timer = None
+            if self.held:
+                return # rendered when the hold ends
+        self.flush()
+
+    def flush(self):
+        """
+        Run the pending render now (on the calling thread), and wait for a render
+        in progress; called before reading the result of the renders (e.g. by Done)
+        """
+        with self.render_lock:
+            with self.lock:
+                render, self.pending = self.pending, None
+                if self.timer is not None:
+                    self.timer.cancel()
+                    self.timer = None
+
+            if render is not None:
+                self.renders += 1
+                render()
+
+    def cancel(self):
+        """
+        Drop the pending render, if any (e.g. its state is about to be replaced)
+        """
+        with self.lock:
+            if self.pending is not None:
+                self.suppressed += 1
+            self.pending = None
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+
+    @contextmanager
+    def hold(self):
+        """
+        Requests made inside the with block are rendered once, when it ends
+        (e.g. a reset that sets all the controls)
+        """
+        # a render in progress finishes first, and none starts until the hold ends
+        with self.render_lock:
+            with self.lock:
+                self.held += 1
+            try:
+                yield
+            finally:
+                with self.lock:
+                    self.held -= 1
+                    release = self.held == 0
+                if release:
+                    self.flush()
+
+    def stats(self):
+        return {'renders': self.renders, 'suppressed': self.suppressed}
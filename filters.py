@@ -3,97 +3,266 @@ Functions for adding filters to the image
 """
 
 import numpy as np
+import cv2
+import config as cfg
 from math import pi as pi
 from color_model import *
-from bilateralFilter import bilateralFilterFast
+from bilateralFilter import bilateralFilterFast, bilateralFilterTiled, bilateralFilterSeparable
+from bilateral_grid import bilateralGrid
+from jobs import Cancelled
 
-def adjustBrightness(factor, img):
+def adjustBrightness(factor, img, out = None):
     """
     Adjust image brightness
     Add factor (-255, 255) to all image pixels and clip in uint8 range
+    out: buffer for the result (may be img, to adjust in place)
     """
-    image = np.array(img, copy=True).astype(np.uint32)
-    image = image + factor
-    image = np.clip(image, 0, 255)
-    image = image.astype(np.uint8)
-    return image
+    # saturating uint8 add/subtract, no wider temporaries
+    scalar = (abs(factor),) * 4
+    if factor >= 0:
+        return cv2.add(img, scalar, dst = out)
+    return cv2.subtract(img, scalar, dst = out)
 
-def negativeImage(checker, img):
+def negativeImage(checker, img, out = None):
     """
     Reverse the values of all pixels in the image
+    out: buffer for the result (may be img, to reverse in place)
     """
     if checker == False:
-        return img
+        return keepImage(img, out)
     else:
-        image = np.array(img, copy = True).astype(np.uint8)
-        image = 255 - image
-        return image
+        return cv2.bitwise_not(img, dst = out) # 255 - value for uint8
 
-def grayscaleImage(checker, img):
+def grayscaleImage(checker, img, out = None, chunk = 1 << 20):
     """
     Transform the image to grayscale, a weighted average of r, g, b channels
+    out: buffer for the result (may be img, to transform in place)
     """
     if checker == False:
-        return img
+        return keepImage(img, out)
     else:
-        image = np.array(img, copy = True).astype(np.uint8)
-        image[:, :, 0] = image[:, :, 1] = image[:, :, 2] = \
-            0.2126 * image[:, :, 0] + 0.7152 * image[:, :, 1] + 0.0722*image[:, :, 1]
-        return image
+        # every output channel is the same weighted sum of r, g, b (rounded and saturated)
+        weights = np.array([[0.2126, 0.7152, 0.0722]] * 3, dtype = np.float32)
+        if out is None or not np.shares_memory(out, img):
+            return cv2.transform(img, weights, dst = out)
+
+        # in place cv2.transform copies the whole image to a temporary first,
+        # transform strips of about chunk pixels instead
+        rows = max(1, chunk // img.shape[1])
+        for start in range(0, img.shape[0], rows):
+            out[start:start + rows] = cv2.transform(img[start:start + rows], weights)
+        return out
 
-def adjustContrast(factor, img):
+def adjustContrast(factor, img, out = None):
     """
     Adjust Contrast: multiply every pixel by factor (0, 2) and clip to uint8 range
+    out: buffer for the result (may be img, to adjust in place)
+    """
+    # a 256 entry table of the clipped products, applied in one uint8 pass
+    return PointFilterPipeline().contrast(factor).apply(img, out)
+
+def keepImage(img, out):
+    """
+    Result of a filter that leaves the image unchanged
     """
-    image = np.array(img, copy=True).astype(np.uint32)
-    image = image * factor
-    image = np.clip(image, 0, 255)
-    image = image.astype(np.uint8)
-    return image
+    if out is None or out is img:
+        return img
+    np.copyto(out, img)
+    return out
+
+class PointFilterPipeline:
+    """
+    Chain of point operations (brightness, contrast, negative, gamma, levels)
+    compiled to a single 256 entry lookup table, so that the whole chain costs
+    one pass over the image
+    Every operation rounds and clips to uint8 like the corresponding filter, 
+    so the result is the same as applying the filters one after the other
+
+    Example: PointFilterPipeline().brightness(20).contrast(1.2).apply(img)
+    """
+    def __init__(self):
+        self.ops = [] # functions on float64 arrays of pixel values
+        self.table = None # compiled lut
+
+    def add(self, op):
+        self.ops.append(op)
+        self.table = None
+        return self
+
+    def brightness(self, factor):
+        """
+        Add factor (-255, 255), as adjustBrightness
+        """
+        return self.add(lambda v: np.clip(v + factor, 0, 255))
+
+    def contrast(self, factor):
+        """
+        Multiply by factor (0, 2), as adjustContrast (truncated to uint8)
+        """
+        return self.add(lambda v: np.floor(np.clip(v * factor, 0, 255)))
+
+    def negative(self, checker = True):
+        """
+        Reverse the values, as negativeImage
+        """
+        if not checker:
+            return self
+        return self.add(lambda v: 255 - v)
+
+    def gamma(self, gamma):
+        """
+        Gamma correction: 255 * (v / 255) ^ (1 / gamma)
+        """
+        return self.add(lambda v: np.round(255 * (v / 255) ** (1 / gamma)))
+
+    def levels(self, in_low = 0, in_high = 255, out_low = 0, out_high = 255):
+        """
+        Map [in_low, in_high] linearly to [out_low, out_high], clipping values outside
+        """
+        def op(v):
+            v = (np.clip(v, in_low, in_high) - in_low) / max(in_high - in_low, 1)
+            return np.round(out_low + v * (out_high - out_low))
+        return self.add(op)
+
+    def lut(self):
+        """
+        Compose the operations into a uint8 lookup table
+        """
+        if self.table is None:
+            values = np.arange(256, dtype = np.float64)
+            for op in self.ops:
+                values = op(values)
+            self.table = np.clip(values, 0, 255).astype(np.uint8)
+        return self.table
+
+    def apply(self, img, out = None):
+        """
+        Apply the chain to img in one pass (out may be img, to edit it in place)
+        """
+        return cv2.LUT(img, self.lut(), dst = out)
 
 def changeHue(factor, img):
     """
     Change hue
-    Must first convert to hls color space
-    Factor is a number from 0 to 180 and represents the hue shift in degrees
+    Factor is a number from 0 to 180 and represents the hue shift 
+    (in opencv hue units, hue wraps around at 180)
     """
-    # transform to hls and extract channels
-    hls = rgb_to_hls(img)
-    h = hls[:, :, 0]
-    l = hls[:, :, 1]
-    s = hls[:, :, 2]
-
-    # add factor to hue channel, merge and transform to rgb
-    hnew = cv2.add(h, factor)
-    hls = cv2.merge([hnew, l, s])
-    rgb = hls_to_rgb(hls)
-    return rgb.astype(np.uint8)
+    return adjustHueSaturation(factor, 1, img)
 
 def changeSaturation(factor, img):
     """
     Change saturation
-    Must first convert to hsv color space
     Factor is a number from 0 to 2
     """
-    # transform to hsv and extract channels
-    hsv = rgb_to_hsv(img) 
-    h = hsv[:, :, 0]
-    s = hsv[:, :, 1]
-    v = hsv[:, :, 2]
+    return adjustHueSaturation(0, factor, img)
 
-    # multiply saturation channel by factor, merge and transform to hsv
-    snew = cv2.multiply(s, factor)
-    hsv = cv2.merge([h, snew, v])
+def adjustHueSaturation(hue, saturation, img):
+    """
+    Rotate hue by hue (0 to 180) and multiply saturation by saturation (0 to 2)
+    with a single conversion to hsv and back
+    """
+    # transform to hsv, shift h and scale s with one lookup table 
+    # (a column per channel) and transform back to rgb
+    hsv = rgb_to_hsv(img)
+    cv2.LUT(hsv, hsv_adjustment_lut(hue, saturation), dst = hsv)
     rgb = hsv_to_rgb(hsv)
-    return rgb.astype(np.uint8)
+    return rgb
 
-def bilateralFilter(img, sigma_s, sigma_b):
+def bilateralFilter(img, sigma_s, sigma_b, mode = 'exact', out = None, cancelled = None):
     """
     Bilateral Filter
-    Call Cython Module to speedup computations 
+    mode: 'exact' calls the Cython Module to speedup computations, 
+    'tiled' is the same filter computed in cache sized tiles, straight to uint8,
+    'separable' approximates it with a horizontal and a vertical 1D pass,
+    'grid' is the fast bilateral grid approximation (see bilateral_grid.py),
+    'auto' is 'tiled' for windows (2 pi sigma_s) up to cfg.bilateral_separable_window 
+    pixels and 'separable' for larger ones
+    out: uint8 buffer for the result (must not overlap img), allocated if None
+    cancelled: function polled between strips of cfg.bilateral_strip_rows rows, the filter
+    raises jobs.Cancelled as soon as it returns True (the strips are filtered with a halo
+    of k rows, so the result is the same; the grid is not split, it is not local)
     """
-    new_img = bilateralFilterFast(img, sigma_s, sigma_b)
-    new_img = np.asarray(new_img).astype(np.uint8) # float32 to uint8
+    if mode == 'auto':
+        mode = 'tiled' if 2 * pi * sigma_s <= cfg.bilateral_separable_window else 'separable'
+
+    if cancelled is None:
+        new_img = bilateralKernel(img, sigma_s, sigma_b, mode, out)
+    else:
+        new_img = bilateralStrips(img, sigma_s, sigma_b, mode, out, cancelled)
 
     print("Bilateral Filter Done")
     return new_img
+
+def bilateralKernel(img, sigma_s, sigma_b, mode, out = None):
+    """
+    Run the bilateral filter of the given mode (not 'auto') on img
+    """
+    if mode == 'exact':
+        new_img = bilateralFilterFast(img, sigma_s, sigma_b)
+        new_img = np.asarray(new_img).astype(np.uint8) # float32 to uint8
+    elif mode == 'tiled':
+        new_img = bilateralFilterTiled(np.ascontiguousarray(img), sigma_s, sigma_b, out = out)
+    elif mode == 'separable':
+        new_img = bilateralFilterSeparable(img, sigma_s, sigma_b, out = out)
+    elif mode == 'grid':
+        new_img = bilateralGrid(img, sigma_s, sigma_b)
+    else:
+        raise ValueError(f'Unknown bilateral filter mode {mode}')
+
+    if out is not None and new_img is not out:
+        np.copyto(out, new_img)
+        new_img = out
+
+    return new_img
+
+def bilateralStrips(img, sigma_s, sigma_b, mode, out, cancelled):
+    """
+    Bilateral filter computed strip by strip, stopping (raises jobs.Cancelled) when cancelled() is True
+    """
+    if mode == 'grid':
+        if cancelled():
+            raise Cancelled()
+        return bilateralKernel(img, sigma_s, sigma_b, mode, out)
+
+    H = img.shape[0]
+    if out is None:
+        out = np.empty(img.shape, dtype = np.uint8)
+
+    # the window reaches k rows above and below a pixel
+    k = bilateralRadius(sigma_s)
+    rows = cfg.bilateral_strip_rows
+
+    for r0 in range(0, H, rows):
+        if cancelled():
+            raise Cancelled()
+
+        r1 = min(r0 + rows, H)
+        h0, h1 = max(0, r0 - k), min(H, r1 + k)
+        strip = bilateralKernel(img[h0:h1], sigma_s, sigma_b, mode)
+        out[r0:r1] = strip[r0 - h0:r1 - h0]
+
+    return out
+
+def bilateralRadius(sigma_s):
+    """
+    Half size k of the (2k+1) x (2k+1) window of the bilateral kernels, 
+    whose size is 2 pi sigma_s rounded to odd
+    """
+    dim = int(2 * pi * sigma_s)
+    if dim % 2 == 0:
+        dim += 1
+    return (dim - 1) // 2
+
+def downscaleProxy(img, max_side):
+    """
+    Proxy of img for interactive previews: img downscaled so that its longest side 
+    is at most max_side (img itself if it is already small enough)
+    Returns the proxy and the scale factor, by which spatial parameters 
+    (e.g. sigma_s) must be multiplied to preview the filter on the proxy
+    """
+    scale = min(1.0, max_side / max(img.shape[:2]))
+    if scale == 1.0:
+        return img, scale
+
+    proxy = cv2.resize(img, None, fx = scale, fy = scale, interpolation = cv2.INTER_AREA)
+    return proxy, scale
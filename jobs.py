@@ -0,0 +1,119 @@
+"""
+Background execution of the filter previews: jobs run on a worker thread and
+a newer job supersedes the older ones (latest value wins)
+"""
+
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+class Cancelled(Exception):
+    """
+    Raised by a job that stopped because it was superseded or cancelled
+    """
+    pass
+
+class Job:
+    """
+    A submitted job, fn(job) is called on the worker thread
+    Long jobs can poll job.cancelled() and raise Cancelled to stop early
+    """
+    def __init__(self):
+        self.future = None
+        self.event = threading.Event()
+
+    def cancel(self):
+        """
+        Returns True if the job was cancelled before it started
+        """
+        self.event.set()
+        return self.future is not None and self.future.cancel() # False if it already started
+
+    def cancelled(self):
+        return self.event.is_set()
+
+    def result(self):
+        """
+        Wait for the job and return its result (raises Cancelled if it was cancelled)
+        """
+        try:
+            return self.future.result()
+        except Exception as e:
+            if self.cancelled():
+                raise Cancelled() from e
+            raise
+
+class LatestJobRunner:
+    """
+    Runs jobs one at a time on a worker thread; submitting a job cancels the previous
+    one, so under fast interaction only the latest value is computed and shown
+    """
+    def __init__(self, name = 'jobs'):
+        self.pool = ThreadPoolExecutor(max_workers = 1, thread_name_prefix = name)
+        self.lock = threading.Lock()
+        self.latest = None
+        self.superseded = 0 # jobs cancelled before finishing or whose result was dropped
+
+    def submit(self, fn, on_result = None, on_error = None):
+        """
+        Run fn(job) in the background and, if no newer job was submitted meanwhile,
+        on_result(result) (on the worker thread too)
+        An exception raised by fn or on_result is passed to on_error(exception), or its
+        traceback is printed if on_error is None; it is raised again by job.result()
+        Returns the Job
+        """
+        job = Job()
+        with self.lock:
+            previous, self.latest = self.latest, job
+        self.cancel_job(previous)
+
+        job.future = self.pool.submit(self.run, job, fn, on_result, on_error)
+        return job
+
+    def run(self, job, fn, on_result, on_error):
+        # a job that started is counted here when it stops, a job that never started in cancel_job
+        try:
+            if job.cancelled():
+                raise Cancelled()
+            result = fn(job)
+
+            with self.lock:
+                if self.latest is not job:
+                    raise Cancelled()
+
+            if on_result is not None:
+                on_result(result)
+            return result
+        except Cancelled:
+            with self.lock:
+                self.superseded += 1
+            raise
+        except Exception as e:
+            # nobody waits for the future until Done, report the error now
+            if on_error is not None:
+                on_error(e)
+            else:
+                traceback.print_exc()
+            raise
+
+    def cancel(self):
+        """
+        Cancel the latest job (its result will not be shown)
+        """
+        with self.lock:
+            previous, self.latest = self.latest, None
+        self.cancel_job(previous)
+
+    def cancel_job(self, job):
+        if job is not None and job.cancel():
+            with self.lock:
+                self.superseded += 1
+
+    def wait(self):
+        """
+        Wait for the latest job (and its on_result) and return its result, None if there is none
+        """
+        job = self.latest
+        if job is None:
+            return None
+        return job.result()
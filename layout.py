@@ -6,22 +6,60 @@ import numpy as np
 from PIL import Image
 import matplotlib.pyplot as plt
 import io
+import traceback
 import imageio.v2
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from IPython.display import Image as DisplayImage
+from jobs import LatestJobRunner, Cancelled
+from events import EventCoalescer
 from filters import *
 from face_detection import *
 from eyes_detection import *
 from meme_maker import *
+from detection import SharedDetector
+from asset_store import preload_assets
+from compositor import AssetPreview
 from ipywidgets import GridspecLayout
 
+def show_image(output, img):
+    """
+    Replace the content of output with img
+    Safe to call from a background thread: the figure is drawn without pyplot and 
+    appended to the output widget as a png
+    """
+    fig = Figure()
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot()
+    ax.imshow(img)
+    ax.axis('off')
+
+    png = io.BytesIO()
+    fig.savefig(png, format = 'png', bbox_inches = 'tight')
+
+    output.outputs = ()
+    output.append_display_data(DisplayImage(data = png.getvalue()))
+
+def show_error(output, error):
+    """
+    Show the traceback of error in output, like an exception raised by a handler
+    Safe to call from a background thread
+    """
+    output.outputs = () # not the preview of the previous value
+    output.append_stderr(''.join(traceback.format_exception(type(error), error, error.__traceback__)))
+
 class MemeAssetLayout:
     """
     Class that adds meme assets
     """
-    def __init__(self, uploader, filters):
+    def __init__(self, uploader, filters, detector = None):
         self.uploader = uploader # Upload file tab
         self.filters = filters # Filters tab
+        self.detector = detector if detector is not None else SharedDetector() # detections shared between layouts
         self.img = None
         self.tmp_img = None # img before committing changes
+        self.preview = AssetPreview() # incremental rendering of the chosen asset
+        self.events = EventCoalescer() # one render per burst of control changes
         self.face_choice = -1 # which face to add asset to
         self.asset_choice = -1 # which asset to add
         self.asset_scale = 1 
@@ -157,48 +195,54 @@ class MemeAssetLayout:
         """
         Update canvas when a new image is uploaded
         """
-        self.uploaded_file = self.uploader.uploader.value[0]
-        self.uploaded_file_type = self.uploaded_file['type']
+        # a pending render would mix the old detections with the new img
+        with self.events.hold():
+            self.events.cancel()
+            self.uploaded_file = self.uploader.uploader.value[0]
+            self.uploaded_file_type = self.uploaded_file['type']
 
-        if self.uploader.uploaded_image is not None  and self.uploaded_file_type in cfg.supported_types_list:
-            self.img = self.uploader.uploaded_image
-        else:
-            self.img = None
+            if self.uploader.uploaded_image is not None  and self.uploaded_file_type in cfg.supported_types_list:
+                self.img = self.uploader.uploaded_image
+            else:
+                self.img = None
         
-        for output in self.outputs:
-            with output:
-                if self.img is not None:
-                    output.clear_output(wait=True)
-                    # perform face detection and draw bounding boxes
-                    self.img_w_boxes, self.detections = face_detection(self.img)
-                    self.num_detections = len(self.detections)
-                    self.choose_face_dropdown.options = [(str(i+1), i) for i in range(self.num_detections)]
-                    img_plot = plt.imshow(self.img_w_boxes)
-                    img_plot = plt.axis('off')
-                    plt.show()    
-                else:
-                    output.clear_output(wait=False)        
+            for output in self.outputs:
+                with output:
+                    if self.img is not None:
+                        output.clear_output(wait=True)
+                        # perform face detection and draw bounding boxes
+                        self.img_w_boxes, self.detections = face_detection(self.img, self.detector.get(self.img))
+                        self.num_detections = len(self.detections)
+                        self.choose_face_dropdown.options = [(str(i+1), i) for i in range(self.num_detections)]
+                        img_plot = plt.imshow(self.img_w_boxes)
+                        img_plot = plt.axis('off')
+                        plt.show()    
+                    else:
+                        output.clear_output(wait=False)        
         
-        # reset controls to initial state
-        self.reset()
+            # reset controls to initial state
+            self.reset()
 
     # when done button from filters tab is pressed, update img
     def done_filter_btn_handler(self, btn):
         """
         Update canvas when a done filter btn is pressed
         """
-        self.img = self.filters.tmp_img
-        with self.detection_output:
-            self.detection_output.clear_output(wait=True)
-            # perform face detection and draw bounding boxes
-            self.img_w_boxes, self.detections = face_detection(self.img)
-            self.num_detections = len(self.detections)
-            self.choose_face_dropdown.options = [(str(i+1), i) for i in range(self.num_detections)]
-            img_plot = plt.imshow(self.img_w_boxes)
-            img_plot = plt.axis('off')
-            plt.show()
+        # a pending render would mix the old detections with the new img
+        with self.events.hold():
+            self.events.cancel()
+            self.img = self.filters.tmp_img
+            with self.detection_output:
+                self.detection_output.clear_output(wait=True)
+                # perform face detection and draw bounding boxes
+                self.img_w_boxes, self.detections = face_detection(self.img, self.detector.get(self.img))
+                self.num_detections = len(self.detections)
+                self.choose_face_dropdown.options = [(str(i+1), i) for i in range(self.num_detections)]
+                img_plot = plt.imshow(self.img_w_boxes)
+                img_plot = plt.axis('off')
+                plt.show()
 
-        self.reset()
+            self.reset()
 
     def choose_face_dropdown_handler(self, change):
         """
@@ -238,133 +282,106 @@ class MemeAssetLayout:
         self.asset_vertical_slider.min = -W // 2
         self.asset_vertical_slider.max = W // 2
 
-        with self.edit_canvas:
-            # add asset only if a face has been chosen
-            if change['new'] is not None and self.face_choice != -1 and self.img is not None:
-                self.asset_choice = change['new']
-                self.edit_canvas.clear_output(wait = True)
-                self.tmp_img = add_asset(cfg.meme_face_assets, self.detections, self.face_choice, 
-                                            self.asset_choice, self.img)
-                img_plot = plt.imshow(self.tmp_img)
-                img_plot = plt.axis('off')
-                plt.show()
+        # add asset only if a face has been chosen
+        if change['new'] is not None and self.face_choice != -1 and self.img is not None:
+            self.asset_choice = change['new']
+            self.events.request(self.render_asset)
         
     def done_btn_handler(self, btn):
         """
         Update img when the done button is pressed
         """
+        self.events.flush() # the last change may not be rendered yet
         if self.tmp_img is not None:
             self.img = self.tmp_img
 
+    def render_asset(self):
+        """
+        Draw the chosen asset with the current controls; only the rectangles
+        the asset covered before and covers now are recomputed
+        """
+        if self.asset_choice == -1 or self.face_choice == -1:
+            return
+
+        self.tmp_img = self.preview.render(self.img, cfg.meme_face_assets[self.asset_choice], self.detections[self.face_choice],
+                                           scale = self.asset_scale, offset_x = self.offset_x, offset_y = self.offset_y,
+                                           flip_x = self.flip_x, flip_y = self.flip_y, place = face_box)
+        show_image(self.edit_canvas, self.tmp_img) # may run on the events timer thread
+
     def asset_scale_handler(self, change):
         """
         Handler invoked when an asset scale is chosen
         """
         self.asset_scale = change['new']
-        with self.edit_canvas:
-            self.edit_canvas.clear_output(wait=True)
-            self.tmp_img = add_asset(cfg.meme_face_assets, self.detections, self.face_choice, 
-                                     self.asset_choice, self.img, offset_y = self.offset_y, 
-                                     offset_x = self.offset_x, bounding_box_scale = self.asset_scale,
-                                     flip_x = self.flip_x, flip_y = self.flip_y)
-            img_plot = plt.imshow(self.tmp_img)
-            img_plot = plt.axis('off')
-            plt.show()
+        self.events.request(self.render_asset)
 
     def asset_horizontal_slider_handler(self, change):
         """
         Handler invoked when a value from the horizontal slider is chosen
         """
         self.offset_x= change['new']
-        with self.edit_canvas:
-            self.edit_canvas.clear_output(wait=True)
-            self.tmp_img = add_asset(cfg.meme_face_assets, self.detections, self.face_choice, 
-                                     self.asset_choice, self.img, offset_y = self.offset_y, 
-                                     offset_x = self.offset_x, bounding_box_scale = self.asset_scale,
-                                     flip_x = self.flip_x, flip_y = self.flip_y)
-            img_plot = plt.imshow(self.tmp_img)
-            img_plot = plt.axis('off')
-            plt.show()
+        self.events.request(self.render_asset)
 
     def asset_vertical_slider_handler(self, change):
         """
         Handler invoked when a value from the vertical slider is chosen
         """
         self.offset_y = change['new']
-        with self.edit_canvas:
-            self.edit_canvas.clear_output(wait=True)
-            self.tmp_img = add_asset(cfg.meme_face_assets, self.detections, self.face_choice, 
-                                     self.asset_choice, self.img, offset_y = self.offset_y, 
-                                     offset_x = self.offset_x, bounding_box_scale = self.asset_scale,
-                                     flip_x = self.flip_x, flip_y = self.flip_y)
-            img_plot = plt.imshow(self.tmp_img)
-            img_plot = plt.axis('off')
-            plt.show()
+        self.events.request(self.render_asset)
 
     def asset_hflip_checker_handler(self, change):
         """
         Handler invoked when hflip checker state changes
         """
         self.flip_x = change['new']
-        with self.edit_canvas:
-            self.edit_canvas.clear_output(wait = True)
-            self.tmp_img = add_asset(cfg.meme_face_assets, self.detections, self.face_choice,
-                                    self.asset_choice, self.img, offset_y = self.offset_y, 
-                                    offset_x = self.offset_x, bounding_box_scale = self.asset_scale,
-                                    flip_x = self.flip_x, flip_y = self.flip_y)
-            img_plot = plt.imshow(self.tmp_img)
-            img_plot = plt.axis('off')
-            plt.show()
+        self.events.request(self.render_asset)
 
     def asset_vflip_checker_handler(self, change):
         """
         Handler invoked when vflip checker state changes
         """
         self.flip_y = change['new']
-        with self.edit_canvas:
-            self.edit_canvas.clear_output(wait = True)
-            self.tmp_img = add_asset(cfg.meme_face_assets, self.detections, self.face_choice,
-                                    self.asset_choice, self.img, offset_y = self.offset_y, 
-                                    offset_x = self.offset_x, bounding_box_scale = self.asset_scale,
-                                    flip_x = self.flip_x, flip_y = self.flip_y)
-            img_plot = plt.imshow(self.tmp_img)
-            img_plot = plt.axis('off')
-            plt.show()
+        self.events.request(self.render_asset)
 
     def reset(self):
         """
         Reset when a new image is uploaded
         """
-        self.edit_canvas.clear_output(wait=False)
-        self.asset_scale_slider.layout.visibility = 'hidden'
-        self.asset_horizontal_slider.layout.visibility = 'hidden'
-        self.asset_vertical_slider.layout.visibility = 'hidden'
-        self.done_btn.layout.visibility = 'hidden'
-        self.choose_face_dropdown.value = None
-        self.choose_asset_dropdown.value = None
-        self.face_choice = -1
-        self.asset_choice = -1
-        self.choose_asset_dropdown.disabled = True
-        self.asset_scale_slider.value = 1
-        self.asset_horizontal_slider.value = 0
-        self.asset_vertical_slider.value = 0
-        self.asset_hflip_checker.value = False
-        self.asset_vflip_checker.value = False
-        self.offset_x = 0
-        self.offset_y = 0
-        self.flip_x = 0
-        self.flip_y = 0
+        # the controls set below trigger their handlers, render once at the end
+        with self.events.hold():
+            self.edit_canvas.clear_output(wait=False)
+            self.asset_scale_slider.layout.visibility = 'hidden'
+            self.asset_horizontal_slider.layout.visibility = 'hidden'
+            self.asset_vertical_slider.layout.visibility = 'hidden'
+            self.done_btn.layout.visibility = 'hidden'
+            self.choose_face_dropdown.value = None
+            self.choose_asset_dropdown.value = None
+            self.face_choice = -1
+            self.asset_choice = -1
+            self.choose_asset_dropdown.disabled = True
+            self.asset_scale_slider.value = 1
+            self.asset_horizontal_slider.value = 0
+            self.asset_vertical_slider.value = 0
+            self.asset_hflip_checker.value = False
+            self.asset_vflip_checker.value = False
+            self.offset_x = 0
+            self.offset_y = 0
+            self.flip_x = 0
+            self.flip_y = 0
 
 class AddGlassesLayout:
     """
     Class for adding glasses, same functions as above, replace face
     detecction and eye detection
     """
-    def __init__(self, uploader, filters):
+    def __init__(self, uploader, filters, detector = None):
         self.uploader = uploader
         self.filters = filters
+        self.detector = detector if detector is not None else SharedDetector()
         self.img = None
         self.tmp_img = None
+        self.preview = AssetPreview()
+        self.events = EventCoalescer()
         self.eyes_choice = -1
         self.asset_choice = -1
         self.asset_scale = 1
@@ -487,41 +504,47 @@ class AddGlassesLayout:
         self.layout = widgets.VBox(children=[self.detection_output, self.selections, self.edit_canvas_layout])
 
     def new_img_output_handler(self, change):
-        self.uploaded_file = self.uploader.uploader.value[0]
-        self.uploaded_file_type = self.uploaded_file['type']
-
-        if self.uploader.uploaded_image is not None  and self.uploaded_file_type in cfg.supported_types_list:
-            self.img = self.uploader.uploaded_image
-        else:
-            self.img = None
+        # a pending render would mix the old detections with the new img
+        with self.events.hold():
+            self.events.cancel()
+            self.uploaded_file = self.uploader.uploader.value[0]
+            self.uploaded_file_type = self.uploaded_file['type']
+
+            if self.uploader.uploaded_image is not None  and self.uploaded_file_type in cfg.supported_types_list:
+                self.img = self.uploader.uploaded_image
+            else:
+                self.img = None
         
-        for output in self.outputs:
-            with output:
-                if self.img is not None:
-                    output.clear_output(wait=True)
-                    self.img_w_boxes, self.detections = eyes_detection(self.img)
-                    self.num_detections = len(self.detections)
-                    self.choose_face_dropdown.options = [(str(i+1), i) for i in range(self.num_detections)]
-                    img_plot = plt.imshow(self.img_w_boxes)
-                    img_plot = plt.axis('off')
-                    plt.show()        
-                else:
-                    output.clear_output(wait=False)    
-
-        self.reset()
+            for output in self.outputs:
+                with output:
+                    if self.img is not None:
+                        output.clear_output(wait=True)
+                        self.img_w_boxes, self.detections = eyes_detection(self.img, self.detector.get(self.img))
+                        self.num_detections = len(self.detections)
+                        self.choose_face_dropdown.options = [(str(i+1), i) for i in range(self.num_detections)]
+                        img_plot = plt.imshow(self.img_w_boxes)
+                        img_plot = plt.axis('off')
+                        plt.show()        
+                    else:
+                        output.clear_output(wait=False)    
+
+            self.reset()
 
     def done_filter_btn_handler(self, btn):
-        self.img = self.filters.tmp_img
-        with self.detection_output:
-            self.detection_output.clear_output(wait=True)
-            self.img_w_boxes, self.detections = eyes_detection(self.img)
-            self.num_detections = len(self.detections)
-            self.choose_face_dropdown.options = [(str(i+1), i) for i in range(self.num_detections)]
-            img_plot = plt.imshow(self.img_w_boxes)
-            img_plot = plt.axis('off')
-            plt.show()
+        # a pending render would mix the old detections with the new img
+        with self.events.hold():
+            self.events.cancel()
+            self.img = self.filters.tmp_img
+            with self.detection_output:
+                self.detection_output.clear_output(wait=True)
+                self.img_w_boxes, self.detections = eyes_detection(self.img, self.detector.get(self.img))
+                self.num_detections = len(self.detections)
+                self.choose_face_dropdown.options = [(str(i+1), i) for i in range(self.num_detections)]
+                img_plot = plt.imshow(self.img_w_boxes)
+                img_plot = plt.axis('off')
+                plt.show()
 
-        self.reset()
+            self.reset()
 
     def choose_face_dropdown_handler(self, change):
         with self.edit_canvas:
@@ -555,107 +578,76 @@ class AddGlassesLayout:
         self.asset_vertical_slider.min = -W // 2
         self.asset_vertical_slider.max = W // 2
         
-        with self.edit_canvas:
-            if change['new'] is not None and self.eyes_choice != -1 and self.img is not None:
-                self.asset_choice = change['new']
-                self.edit_canvas.clear_output(wait = True)
-                self.tmp_img = add_asset(cfg.eye_assets, self.detections, self.eyes_choice, 
-                                            self.asset_choice, self.img)
-                img_plot = plt.imshow(self.tmp_img)
-                img_plot = plt.axis('off')
-                plt.show()
+        if change['new'] is not None and self.eyes_choice != -1 and self.img is not None:
+            self.asset_choice = change['new']
+            self.events.request(self.render_asset)
         
     def done_btn_handler(self, btn):
+        self.events.flush()
         if self.tmp_img is not None:
             self.img = self.tmp_img
 
+    def render_asset(self):
+        if self.asset_choice == -1 or self.eyes_choice == -1:
+            return
+
+        self.tmp_img = self.preview.render(self.img, cfg.eye_assets[self.asset_choice], self.detections[self.eyes_choice],
+                                           scale = self.asset_scale, offset_x = self.offset_x, offset_y = self.offset_y,
+                                           flip_x = self.flip_x, flip_y = self.flip_y, place = face_box)
+        show_image(self.edit_canvas, self.tmp_img) # may run on the events timer thread
+
     def asset_scale_handler(self, change):
         self.asset_scale = change['new']
-        with self.edit_canvas:
-            self.edit_canvas.clear_output(wait=True)
-            self.tmp_img = add_asset(cfg.eye_assets, self.detections, self.eyes_choice, 
-                                     self.asset_choice, self.img, offset_y = self.offset_y, 
-                                     offset_x = self.offset_x, bounding_box_scale = self.asset_scale,
-                                     flip_x = self.flip_x, flip_y = self.flip_y)
-            img_plot = plt.imshow(self.tmp_img)
-            img_plot = plt.axis('off')
-            plt.show()
+        self.events.request(self.render_asset)
 
     def asset_horizontal_slider_handler(self, change):
         self.offset_x= change['new']
-        with self.edit_canvas:
-            self.edit_canvas.clear_output(wait=True)
-            self.tmp_img = add_asset(cfg.eye_assets, self.detections, self.eyes_choice, 
-                                     self.asset_choice, self.img, offset_y = self.offset_y, 
-                                     offset_x = self.offset_x, bounding_box_scale = self.asset_scale,
-                                     flip_x = self.flip_x, flip_y = self.flip_y)
-            img_plot = plt.imshow(self.tmp_img)
-            img_plot = plt.axis('off')
-            plt.show()
+        self.events.request(self.render_asset)
 
     def asset_vertical_slider_handler(self, change):
         self.offset_y= change['new']
-        with self.edit_canvas:
-            self.edit_canvas.clear_output(wait=True)
-            self.tmp_img = add_asset(cfg.eye_assets, self.detections, self.eyes_choice, 
-                                     self.asset_choice, self.img, offset_y = self.offset_y, 
-                                     offset_x = self.offset_x, bounding_box_scale = self.asset_scale,
-                                     flip_x = self.flip_x, flip_y = self.flip_y)
-            img_plot = plt.imshow(self.tmp_img)
-            img_plot = plt.axis('off')
-            plt.show()
+        self.events.request(self.render_asset)
 
     def asset_hflip_checker_handler(self, change):
         self.flip_x = change['new']
-        with self.edit_canvas:
-            self.edit_canvas.clear_output(wait = True)
-            self.tmp_img = add_asset(cfg.eye_assets, self.detections, self.face_choice,
-                                    self.asset_choice, self.img, offset_y = self.offset_y, 
-                                    offset_x = self.offset_x, bounding_box_scale = self.asset_scale,
-                                    flip_x = self.flip_x, flip_y = self.flip_y)
-            img_plot = plt.imshow(self.tmp_img)
-            img_plot = plt.axis('off')
-            plt.show()
+        self.events.request(self.render_asset)
 
     def asset_vflip_checker_handler(self, change):
         self.flip_y = change['new']
-        with self.edit_canvas:
-            self.edit_canvas.clear_output(wait = True)
-            self.tmp_img = add_asset(cfg.eye_assets, self.detections, self.face_choice,
-                                    self.asset_choice, self.img, offset_y = self.offset_y, 
-                                    offset_x = self.offset_x, bounding_box_scale = self.asset_scale,
-                                    flip_x = self.flip_x, flip_y = self.flip_y)
-            img_plot = plt.imshow(self.tmp_img)
-            img_plot = plt.axis('off')
-            plt.show()
+        self.events.request(self.render_asset)
     
     def reset(self):
-        self.edit_canvas.clear_output(wait=False)
-        self.asset_scale_slider.layout.visibility = 'hidden'
-        self.asset_horizontal_slider.layout.visibility = 'hidden'
-        self.asset_vertical_slider.layout.visibility = 'hidden'
-        self.done_btn.layout.visibility = 'hidden'
-        self.choose_face_dropdown.value = None
-        self.choose_asset_dropdown.value = None
-        self.face_choice = -1
-        self.asset_choice = -1
-        self.choose_asset_dropdown.disabled = True
-        self.asset_scale_slider.value = 1
-        self.asset_horizontal_slider.value = 0
-        self.asset_vertical_slider.value = 0
-        self.asset_hflip_checker.value = False
-        self.asset_vflip_checker.value = False
-        self.offset_x = 0
-        self.offset_y = 0
-        self.flip_x = 0
-        self.flip_y = 0
+        # the controls set below trigger their handlers, render once at the end
+        with self.events.hold():
+            self.edit_canvas.clear_output(wait=False)
+            self.asset_scale_slider.layout.visibility = 'hidden'
+            self.asset_horizontal_slider.layout.visibility = 'hidden'
+            self.asset_vertical_slider.layout.visibility = 'hidden'
+            self.done_btn.layout.visibility = 'hidden'
+            self.choose_face_dropdown.value = None
+            self.choose_asset_dropdown.value = None
+            self.face_choice = -1
+            self.asset_choice = -1
+            self.choose_asset_dropdown.disabled = True
+            self.asset_scale_slider.value = 1
+            self.asset_horizontal_slider.value = 0
+            self.asset_vertical_slider.value = 0
+            self.asset_hflip_checker.value = False
+            self.asset_vflip_checker.value = False
+            self.offset_x = 0
+            self.offset_y = 0
+            self.flip_x = 0
+            self.flip_y = 0
             
 class AddHatLayout:
-    def __init__(self, uploader, filters):
+    def __init__(self, uploader, filters, detector = None):
         self.uploader = uploader = uploader 
         self.filters = filters
+        self.detector = detector if detector is not None else SharedDetector()
         self.img = self.uploader.uploaded_image
         self.tmp_img = None
+        self.preview = AssetPreview()
+        self.events = EventCoalescer()
         self.eyes_choice = -1
         self.asset_choice = -1
         self.asset_scale = 1
@@ -778,41 +770,47 @@ class AddHatLayout:
         self.layout = widgets.VBox(children=[self.detection_output, self.selections, self.edit_canvas_layout])
 
     def new_img_output_handler(self, change):
-        self.uploaded_file = self.uploader.uploader.value[0]
-        self.uploaded_file_type = self.uploaded_file['type']
-
-        if self.uploader.uploaded_image is not None  and self.uploaded_file_type in cfg.supported_types_list:
-            self.img = self.uploader.uploaded_image
-        else:
-            self.img = None
+        # a pending render would mix the old detections with the new img
+        with self.events.hold():
+            self.events.cancel()
+            self.uploaded_file = self.uploader.uploader.value[0]
+            self.uploaded_file_type = self.uploaded_file['type']
+
+            if self.uploader.uploaded_image is not None  and self.uploaded_file_type in cfg.supported_types_list:
+                self.img = self.uploader.uploaded_image
+            else:
+                self.img = None
         
-        for output in self.outputs:
-            with output:
-                if self.img is not None:
-                    output.clear_output(wait=True)
-                    self.img_w_boxes, self.detections = face_detection(self.img)
-                    self.num_detections = len(self.detections)
-                    self.choose_face_dropdown.options = [(str(i+1), i) for i in range(self.num_detections)]
-                    img_plot = plt.imshow(self.img_w_boxes)
-                    img_plot = plt.axis('off')
-                    plt.show()           
-                else:
-                    output.clear_output(wait=False) 
-
-        self.reset()
+            for output in self.outputs:
+                with output:
+                    if self.img is not None:
+                        output.clear_output(wait=True)
+                        self.img_w_boxes, self.detections = face_detection(self.img, self.detector.get(self.img))
+                        self.num_detections = len(self.detections)
+                        self.choose_face_dropdown.options = [(str(i+1), i) for i in range(self.num_detections)]
+                        img_plot = plt.imshow(self.img_w_boxes)
+                        img_plot = plt.axis('off')
+                        plt.show()           
+                    else:
+                        output.clear_output(wait=False) 
+
+            self.reset()
 
     def done_filter_btn_handler(self, btn):
-        self.img = self.filters.tmp_img
-        with self.detection_output:
-            self.detection_output.clear_output(wait=True)
-            self.img_w_boxes, self.detections = face_detection(self.img)
-            self.num_detections = len(self.detections)
-            self.choose_face_dropdown.options = [(str(i+1), i) for i in range(self.num_detections)]
-            img_plot = plt.imshow(self.img_w_boxes)
-            img_plot = plt.axis('off')
-            plt.show()
+        # a pending render would mix the old detections with the new img
+        with self.events.hold():
+            self.events.cancel()
+            self.img = self.filters.tmp_img
+            with self.detection_output:
+                self.detection_output.clear_output(wait=True)
+                self.img_w_boxes, self.detections = face_detection(self.img, self.detector.get(self.img))
+                self.num_detections = len(self.detections)
+                self.choose_face_dropdown.options = [(str(i+1), i) for i in range(self.num_detections)]
+                img_plot = plt.imshow(self.img_w_boxes)
+                img_plot = plt.axis('off')
+                plt.show()
 
-        self.reset()
+            self.reset()
 
     def choose_face_dropdown_handler(self, change):
         with self.edit_canvas:
@@ -846,100 +844,66 @@ class AddHatLayout:
         self.asset_vertical_slider.min = -W // 2
         self.asset_vertical_slider.max = W // 2
         
-        with self.edit_canvas:
-            if change['new'] is not None and self.eyes_choice != -1 and self.img is not None:
-                self.asset_choice = change['new']
-                self.edit_canvas.clear_output(wait = True)
-                self.tmp_img = add_hat(cfg.hat_assets, self.detections, self.eyes_choice, 
-                                            self.asset_choice, self.img)
-                img_plot = plt.imshow(self.tmp_img)
-                img_plot = plt.axis('off')
-                plt.show()
+        if change['new'] is not None and self.eyes_choice != -1 and self.img is not None:
+            self.asset_choice = change['new']
+            self.events.request(self.render_asset)
         
     def done_btn_handler(self, btn):
+        self.events.flush()
         if self.tmp_img is not None:
             self.img = self.tmp_img
 
+    def render_asset(self):
+        if self.asset_choice == -1 or self.eyes_choice == -1:
+            return
+
+        self.tmp_img = self.preview.render(self.img, cfg.hat_assets[self.asset_choice], self.detections[self.eyes_choice],
+                                           scale = self.asset_scale, offset_x = self.offset_x, offset_y = self.offset_y,
+                                           flip_x = self.flip_x, flip_y = self.flip_y, place = hat_box)
+        show_image(self.edit_canvas, self.tmp_img) # may run on the events timer thread
+
     def asset_scale_handler(self, change):
         self.asset_scale = change['new']
-        with self.edit_canvas:
-            self.edit_canvas.clear_output(wait=True)
-            self.tmp_img = add_hat(cfg.hat_assets, self.detections, self.eyes_choice, 
-                                     self.asset_choice, self.img, offset_y = self.offset_y, 
-                                     offset_x = self.offset_x, asset_scale = self.asset_scale,
-                                     flip_x = self.flip_x, flip_y = self.flip_y)
-            img_plot = plt.imshow(self.tmp_img)
-            img_plot = plt.axis('off')
-            plt.show()
+        self.events.request(self.render_asset)
 
     def asset_horizontal_slider_handler(self, change):
         self.offset_x= change['new']
-        with self.edit_canvas:
-            self.edit_canvas.clear_output(wait=True)
-            self.tmp_img = add_hat(cfg.hat_assets, self.detections, self.eyes_choice, 
-                                     self.asset_choice, self.img, offset_y = self.offset_y, 
-                                     offset_x = self.offset_x, asset_scale = self.asset_scale,
-                                     flip_x = self.flip_x, flip_y = self.flip_y)
-            img_plot = plt.imshow(self.tmp_img)
-            img_plot = plt.axis('off')
-            plt.show()
+        self.events.request(self.render_asset)
 
     def asset_vertical_slider_handler(self, change):
         self.offset_y= change['new']
-        with self.edit_canvas:
-            self.edit_canvas.clear_output(wait=True)
-            self.tmp_img = add_hat(cfg.hat_assets, self.detections, self.eyes_choice, 
-                                     self.asset_choice, self.img, offset_y = self.offset_y, 
-                                     offset_x = self.offset_x, asset_scale = self.asset_scale,
-                                     flip_x = self.flip_x, flip_y = self.flip_y)
-            img_plot = plt.imshow(self.tmp_img)
-            img_plot = plt.axis('off')
-            plt.show()
+        self.events.request(self.render_asset)
     
     def asset_hflip_checker_handler(self, change):
         self.flip_x = change['new']
-        with self.edit_canvas:
-            self.edit_canvas.clear_output(wait = True)
-            self.tmp_img = add_hat(cfg.hat_assets, self.detections, self.face_choice,
-                                    self.asset_choice, self.img, offset_y = self.offset_y, 
-                                    offset_x = self.offset_x, asset_scale = self.asset_scale,
-                                    flip_x = self.flip_x, flip_y = self.flip_y)
-            img_plot = plt.imshow(self.tmp_img)
-            img_plot = plt.axis('off')
-            plt.show()
+        self.events.request(self.render_asset)
 
     def asset_vflip_checker_handler(self, change):
         self.flip_y = change['new']
-        with self.edit_canvas:
-            self.edit_canvas.clear_output(wait = True)
-            self.tmp_img = add_hat(cfg.hat_assets, self.detections, self.face_choice,
-                                    self.asset_choice, self.img, offset_y = self.offset_y, 
-                                    offset_x = self.offset_x, asset_scale = self.asset_scale,
-                                    flip_x = self.flip_x, flip_y = self.flip_y)
-            img_plot = plt.imshow(self.tmp_img)
-            img_plot = plt.axis('off')
-            plt.show()
+        self.events.request(self.render_asset)
 
     def reset(self):
-        self.edit_canvas.clear_output(wait=False)
-        self.asset_scale_slider.layout.visibility = 'hidden'
-        self.asset_horizontal_slider.layout.visibility = 'hidden'
-        self.asset_vertical_slider.layout.visibility = 'hidden'
-        self.done_btn.layout.visibility = 'hidden'
-        self.choose_face_dropdown.value = None
-        self.choose_asset_dropdown.value = None
-        self.face_choice = -1
-        self.asset_choice = -1
-        self.choose_asset_dropdown.disabled = True
-        self.asset_scale_slider.value = 1
-        self.asset_horizontal_slider.value = 0
-        self.asset_vertical_slider.value = 0
-        self.asset_hflip_checker.value = False
-        self.asset_vflip_checker.value = False
-        self.offset_x = 0
-        self.offset_y = 0
-        self.flip_x = 0
-        self.flip_y = 0
+        # the controls set below trigger their handlers, render once at the end
+        with self.events.hold():
+            self.edit_canvas.clear_output(wait=False)
+            self.asset_scale_slider.layout.visibility = 'hidden'
+            self.asset_horizontal_slider.layout.visibility = 'hidden'
+            self.asset_vertical_slider.layout.visibility = 'hidden'
+            self.done_btn.layout.visibility = 'hidden'
+            self.choose_face_dropdown.value = None
+            self.choose_asset_dropdown.value = None
+            self.face_choice = -1
+            self.asset_choice = -1
+            self.choose_asset_dropdown.disabled = True
+            self.asset_scale_slider.value = 1
+            self.asset_horizontal_slider.value = 0
+            self.asset_vertical_slider.value = 0
+            self.asset_hflip_checker.value = False
+            self.asset_vflip_checker.value = False
+            self.offset_x = 0
+            self.offset_y = 0
+            self.flip_x = 0
+            self.flip_y = 0
 
 class MemeMakerLayout:
     def __init__(self, uploader, filters):
@@ -950,9 +914,13 @@ class MemeMakerLayout:
         self.filters = filters
         self.img = self.uploader.uploaded_image
         self.uploader.uploader.observe(self.new_img_output_handler, names = 'value')
-        self.meme_assets_layout = MemeAssetLayout(self.uploader, self.filters)
-        self.add_glasses_layout = AddGlassesLayout(self.uploader, self.filters)
-        self.add_hat_layout = AddHatLayout(self.uploader, self.filters)
+        # decode all assets now, so that the sliders never wait for the png decoder
+        preload_assets()
+        # the 3 layouts show the same image, so detection is run once and shared
+        self.detector = SharedDetector()
+        self.meme_assets_layout = MemeAssetLayout(self.uploader, self.filters, self.detector)
+        self.add_glasses_layout = AddGlassesLayout(self.uploader, self.filters, self.detector)
+        self.add_hat_layout = AddHatLayout(self.uploader, self.filters, self.detector)
         self.done_btns = []
 
         for btn in self.filters.done_btns:
@@ -1072,6 +1040,16 @@ class FilterLayout:
         self.sigma_s = 1
         self.sigma_b = 1
 
+        # the filters run in the background, a new value cancels the computation of the previous one,
+        # and a burst of control changes is coalesced into one filter run
+        self.jobs = LatestJobRunner('filters')
+        self.events = EventCoalescer()
+
+        # bilateral filter: downscaled proxy of new_img (source, proxy, scale) for the previews,
+        # and the last preview (source, sigma_s, sigma_b, job) when it ran at full resolution
+        self.bilateral_proxy = None
+        self.bilateral_job = None
+
         # --------- Control Widgets --------- #
         self.brightness_slider = widgets.IntSlider(
             value=0,
@@ -1312,7 +1290,7 @@ class FilterLayout:
         self.bilateral_sigma_s_slider.observe(self.bilateral_sigma_s_slider_handler, names = 'value')
         self.bilateral_sigma_b_slider.observe(self.bilateral_sigma_b_slider_handler, names = 'value')
         self.bilateral_undo_btn.on_click(self.undo_btn_handler)
-        self.bilateral_done_btn.on_click(self.done_btn_handler)
+        self.bilateral_done_btn.on_click(self.bilateral_done_btn_handler)
         self.bilateral_img_output = widgets.Output()
         self.bilateral_btns = widgets.HBox(children=[self.bilateral_done_btn, self.bilateral_undo_btn])
         self.bilateral_sliders = widgets.VBox(children=[self.bilateral_sigma_s_slider, self.bilateral_sigma_b_slider])
@@ -1350,6 +1328,9 @@ class FilterLayout:
         """
         self.uploaded_file = self.uploader.uploader.value[0]
         self.uploaded_file_type = self.uploaded_file['type']
+
+        # results of the previous image are not needed anymore
+        self.jobs.cancel()
         
         if self.uploader.uploaded_image is not None and self.uploaded_file_type in cfg.supported_types_list:
             # display controls if the image type is supported
@@ -1393,6 +1374,8 @@ class FilterLayout:
         """
         Handler for the done buttons, update the image
         """
+        # the filter of the last change may still be running, it sets tmp_img
+        self.wait_filter()
         self.new_img = self.tmp_img
         self.img = self.tmp_img
     
@@ -1400,101 +1383,133 @@ class FilterLayout:
         """
         Handler for the done buttons, update the image
         """
+        self.jobs.cancel()
         self.img = self.new_img
 
         self.reset()
 
+    def run_filter(self, output, fn, *args):
+        """
+        Compute fn(*args, self.new_img) in the background, then store it in tmp_img 
+        and show it in output; only the latest filter requested is shown
+        """
+        def render():
+            img = self.new_img
+            self.jobs.submit(lambda job: fn(*args, img), on_result = lambda result: self.show_filter(output, result),
+                             on_error = lambda error: show_error(output, error))
+        self.events.request(render)
+
+    def show_filter(self, output, result):
+        self.tmp_img = result
+        show_image(output, result)
+
+    def wait_filter(self):
+        """
+        Wait for the filter of the last change (a cancelled one leaves tmp_img as it is)
+        """
+        self.events.flush()
+        try:
+            self.jobs.wait()
+        except Cancelled:
+            pass
+
     def brightness_slider_handler(self, change):
         """
         Handler for the brightness slider, call the adjustBrightness function with the new value
         """
-        self.brightness_img_output.clear_output(wait=True)
-        self.tmp_img = adjustBrightness(change['new'], self.new_img)
-        with self.brightness_img_output:
-            img_plot = plt.imshow(self.tmp_img)
-            img_plot = plt.axis('off')
-            plt.show()
+        self.run_filter(self.brightness_img_output, adjustBrightness, change['new'])
 
     def negative_checker_handler(self, change):
         """
         Handler for the negative checker, if checked, then negative image, if unchecked, the original image
         """
-        self.negative_img_output.clear_output(wait=True)
-        self.tmp_img = negativeImage(change['new'], self.new_img)
-        with self.negative_img_output:
-            img_plot = plt.imshow(self.tmp_img)
-            img_plot = plt.axis('off')
-            plt.show()
+        self.run_filter(self.negative_img_output, negativeImage, change['new'])
 
     def grayscale_checker_handler(self, change):
         """
         Handler for the grayscale checker, if checked, then grayscale image, if unchecked, the original image
         """
-        self.grayscale_img_output.clear_output(wait=True)
-        self.tmp_img = grayscaleImage(change['new'], self.new_img)
-        with self.grayscale_img_output:
-            img_plot = plt.imshow(self.tmp_img)
-            img_plot = plt.axis('off')
-            plt.show()
+        self.run_filter(self.grayscale_img_output, grayscaleImage, change['new'])
 
     def contrast_slider_handler(self, change):
         """
         Handler for the contrast slider, call the adjustContrast function with the new value
         """
-        self.contrast_img_output.clear_output(wait=True)
-        self.tmp_img = adjustContrast(change['new'], self.new_img)
-        with self.contrast_img_output:
-            img_plot = plt.imshow(self.tmp_img)
-            img_plot = plt.axis('off')
-            plt.show()
+        self.run_filter(self.contrast_img_output, adjustContrast, change['new'])
 
     def hue_slider_handler(self, change):
         """
         Handler for the hue slider, call the changeHue function with the new value
         """
-        self.hue_img_output.clear_output(wait=True)
-        self.tmp_img = changeHue(change['new'], self.new_img)
-        with self.hue_img_output:
-            img_plot = plt.imshow(self.tmp_img)
-            img_plot = plt.axis('off')
-            plt.show()
+        self.run_filter(self.hue_img_output, changeHue, change['new'])
 
     def saturation_slider_handler(self, change):
         """
         Handler for the saturation slider, call the changeSaturation function with the new value
         """
-        self.saturation_img_output.clear_output(wait=True)
-        self.tmp_img = changeSaturation(change['new'], self.new_img)
-        with self.saturation_img_output:
-            img_plot = plt.imshow(self.tmp_img)
-            img_plot = plt.axis('off')
-            plt.show()
+        self.run_filter(self.saturation_img_output, changeSaturation, change['new'])
 
     def bilateral_sigma_s_slider_handler(self, change):
         """
         Handler for the sigma_s parameter of the bilater filter
         """
-        self.bilateral_img_output.clear_output(wait=True)
         self.sigma_s = change['new']
-        self.tmp_img = bilateralFilter(self.new_img, self.sigma_s, self.sigma_b)
-
-        with self.bilateral_img_output:
-            img_plot = plt.imshow(self.tmp_img)
-            img_plot = plt.axis('off')
-            plt.show()
+        self.events.request(self.bilateral_preview)
 
     def bilateral_sigma_b_slider_handler(self, change):
         """
         Handler for the sigma_b parameter of the bilater filter
         """
-        self.bilateral_img_output.clear_output(wait=True)
         self.sigma_b = change['new']
-        self.tmp_img = bilateralFilter(self.new_img, self.sigma_s, self.sigma_b)
+        self.events.request(self.bilateral_preview)
 
-        with self.bilateral_img_output:
-            img_plot = plt.imshow(self.tmp_img)
-            img_plot = plt.axis('off')
-            plt.show()
+    def bilateral_preview(self):
+        """
+        Show the bilateral filter with the current sigmas on the downscaled proxy of the image,
+        in the background: a newer value cancels it
+        The full resolution result is computed when Done is pressed
+        """
+        if self.new_img is None:
+            return
+
+        if self.bilateral_proxy is None or self.bilateral_proxy[0] is not self.new_img:
+            self.bilateral_proxy = (self.new_img, ) + downscaleProxy(self.new_img, cfg.bilateral_preview_max_side)
+        img, proxy, scale = self.bilateral_proxy
+        sigma_s, sigma_b = self.sigma_s, self.sigma_b
+        show = lambda result: show_image(self.bilateral_img_output, result)
+        error = lambda error: show_error(self.bilateral_img_output, error)
+
+        if scale == 1.0 and cfg.bilateral_preview_mode == cfg.bilateral_mode:
+            # the preview is the full resolution result, kept for Done (cancelled between two strips of rows)
+            job = self.jobs.submit(lambda job: bilateralFilter(img, sigma_s, sigma_b, mode = cfg.bilateral_mode, cancelled = job.cancelled),
+                                   on_result = show, on_error = error)
+            self.bilateral_job = (img, sigma_s, sigma_b, job)
+        else:
+            self.jobs.submit(lambda job: bilateralFilter(proxy, sigma_s * scale, sigma_b, mode = cfg.bilateral_preview_mode), 
+                             on_result = show, on_error = error)
+            self.bilateral_job = None
+
+    def bilateral_done_btn_handler(self, btn):
+        """
+        Handler for the done button of the bilateral filter, compute the full resolution
+        result (unless the last preview already was) and update the image
+        """
+        self.wait_filter()
+
+        result = None
+        if self.bilateral_job is not None and self.bilateral_job[0] is self.new_img \
+                and self.bilateral_job[1:3] == (self.sigma_s, self.sigma_b):
+            try:
+                result = self.bilateral_job[3].result()
+            except Cancelled:
+                pass
+
+        if result is None:
+            # the preview was computed on the proxy, or the image changed since
+            result = bilateralFilter(self.new_img, self.sigma_s, self.sigma_b, mode = cfg.bilateral_mode)
+        self.tmp_img = result
+
+        self.done_btn_handler(btn)
 
 
     def hide_items(self, items):
@@ -1515,14 +1530,16 @@ class FilterLayout:
         """
         Reset controls when a new image is uploaded
         """
-        self.brightness_slider.value = 0
-        self.negative_checker.value = False
-        self.grayscale_checker = False
-        self.contrast_slider.value = 1
-        self.hue_slider.value = 0
-        self.saturation_slider.value = 1
-        self.bilateral_sigma_b_slider.value = 1
-        self.bilateral_sigma_s_slider.value = 1
+        # the controls set below trigger their handlers, filter once at the end
+        with self.events.hold():
+            self.brightness_slider.value = 0
+            self.negative_checker.value = False
+            self.grayscale_checker = False
+            self.contrast_slider.value = 1
+            self.hue_slider.value = 0
+            self.saturation_slider.value = 1
+            self.bilateral_sigma_b_slider.value = 1
+            self.bilateral_sigma_s_slider.value = 1
 
     
 class uploadLayout:
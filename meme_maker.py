@@ -4,125 +4,127 @@ Functions for adding meme assets
 
 import cv2
 import numpy as np
+from asset_store import CachedAsset, get_asset, premultiply, div255
 
-def add_padding(dims, asset):
+def fit_asset(asset, w, h, flip_x = 0, flip_y = 0):
     """
-    Function to add padding, so that asset dims match dims
+    Resize (and flip) the asset to fit in a w x h bounding box, keeping its aspect ratio
+    Returns the resized asset and its offset (dx, dy) in the bounding box,
+    the asset being centered in the box
     """
+    # we need to scale the asset to dimensions (h, w), but keeping
+    # the aspect ratio so it is not distorted
+    scale = min(h / asset.shape[0], w / asset.shape[1])
+    new_dims = (int(asset.shape[1] * scale), int(asset.shape[0] * scale))
 
-    H, W, C = asset.shape
-    h, w = dims
+    if new_dims[0] <= 0 or new_dims[1] <= 0:
+        return None, 0, 0
 
-    # pad_h, pad_w is total padding to be added
-    # vertically and horizontally
-    pad_h, pad_w = h - H, w - W
+    if isinstance(asset, CachedAsset):
+        # flipped and resized starting from the nearest pyramid level
+        asset = asset.resize(new_dims, flip_x, flip_y)
+    else:
+        # must flip before any other process, so it is not cut off
+        if flip_x:
+            asset = np.fliplr(asset)
 
-    pad_h_top = pad_h // 2
-    pad_w_left = pad_w // 2
-    
-    padded_asset = np.zeros((h, w, C))
-    padded_asset[pad_h_top:pad_h_top+H, pad_w_left:pad_w_left+W, :] = asset
-    return padded_asset
+        if flip_y:
+            asset = np.flipud(asset)
 
-def crop_asset(asset, x1, x2, y1, y2, h, w, H, W):
-    """
-    Crop an asset in case it is partially out of frame
-    y1, x1 is the upper left corner of the bounding box
-    y2, x2 is the lower right corner of the bounding box
-    h, w are the height and width of the bounding box
-    H and W are the dimensions of the original img
-    """
-
-    # if the bottom part is cut off, 
-    # we must cutoff the part that is greater than H
-    if y2 > H:
-        y2 = -(y2 - H)
-    else:
-        y2 = h
-    
-    # if the rightmost part is cut off,
-    # we must cutoff the part that has is greater than W
-    if x2 > W:
-        x2 = -(x2 - W)
-    else:
-        x2 = w
-
-    # if the leftmost part is cut off,
-    # we must cutoff the first |x1| columns of the asset
-    if x1 < 0:
-        x1 = -x1
-    else: 
-        x1 = 0
-
-    # if the top part is cut off,
-    # we must cutoff the first |y1| rows of the image
-    if y1 < 0:
-        y1 = -y1
-    else:
-        y1 = 0
+        # resize asset to new_dims    
+        asset = premultiply(cv2.resize(asset, new_dims))
 
-    cropped_asset = asset[y1:y2, x1:x2]
+    # the asset will always be smaller than the bounding box, because the scale is the min,
+    # so it is centered in the box (this is the padding that used to be added around it)
+    dx = (w - new_dims[0]) // 2
+    dy = (h - new_dims[1]) // 2
 
-    return cropped_asset
+    return asset, dx, dy
 
-def overlay_image(img, asset, x, y, w, h, flip_x, flip_y):
+def clip_box(x, y, w, h, H, W):
     """
-    Add asset on top image at position (x, y)
+    Intersect the box (x, y, w, h) with an H x W image
+    Returns the intersection (x1, y1, x2, y2) in image coordinates, or None if empty
     """
+    x1, y1 = max(x, 0), max(y, 0)
+    x2, y2 = min(x + w, W), min(y + h, H)
 
-    H, W, c = img.shape
+    if x1 >= x2 or y1 >= y2:
+        return None
+    return x1, y1, x2, y2
 
-    # (y1, x1), (y1, x2), (y2, x1), (y2, x2) are the edges of the bounding box
-    y1, y2 = y, y + h
-    x1, x2 = x, x + w
+def blend_asset(out, asset, x, y):
+    """
+    Composite the (already resized) asset with its upper left corner at (x, y) 
+    over out, in place. Only the part of out under the asset is touched and
+    the parts of the asset out of frame are skipped
+    asset must be premultiplied, with channels in the same order as out, plus alpha
+    """
+    H, W = out.shape[:2]
+    h, w = asset.shape[:2]
 
-    # must flip before any other process, so it is not cut off
-    if flip_x:
-        asset = np.fliplr(asset)
+    box = clip_box(x, y, w, h, H, W)
+    if box is None:  # asset out of frame
+        return out
 
-    if flip_y:
-        asset = np.flipud(asset)
+    x1, y1, x2, y2 = box
 
-    # we need to scale the asset to dimensions (h, w), but keeping
-    # the aspect ratio so it is not distorted
-    scale = min(h / asset.shape[0], w / asset.shape[1])
-    new_dims = (int(asset.shape[1] * scale), int(asset.shape[0] * scale))
+    # views of the destination and of the visible part of the asset
+    roi = out[y1:y2, x1:x2]
+    front = asset[y1-y:y2-y, x1-x:x2-x]
 
-    # resize asset to new_dims    
-    asset = cv2.resize(asset, new_dims)
+    # "over" operator with a premultiplied asset, in 8 bit fixed point:
+    # roi = front + roi * (255 - alpha) / 255
+    tmp = roi.astype(np.uint16)
+    tmp *= 255 - front[:, :, 3:4]
+    div255(tmp)
+    tmp += front[:, :, 0:3]
+    roi[...] = tmp # cannot overflow: front <= alpha and roi * (255 - alpha) / 255 <= 255 - alpha
 
-    # add padding to asset to match bounding box dimensions
-    # the asset will always be smaller, because the scale is the min
-    new_asset = add_padding((h, w), asset)
+    return out
 
-    # crop the part of the image where the bounding box is
-    img_crop = img[max(y1, 0):min(y2, H), max(x1, 0):min(x2, W), :]
+def overlay_image(img, asset, x, y, w, h, flip_x, flip_y, out = None):
+    """
+    Add asset on top image img, fitted in the bounding box (x, y, w, h)
+    asset is either an array (straight alpha) or a CachedAsset from the asset 
+    store, with its channels in the same order as img (plus alpha); the result
+    has the channel order of img
+    out: buffer the result is written to (may be img itself, to draw in place),
+    if None a copy of img is made
+    """
+    if out is None:
+        out = img.copy()
+    elif out is not img:
+        np.copyto(out, img)
 
-    # if asset out of frame return original image
-    if y2 < 0 or x2 < 0:
-        img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-        return img
-    
-    # crop asset in case it is partially out of frame
-    new_asset = crop_asset(new_asset, x1, x2, y1, y2, h, w, H, W)
-    
-    # extract asset alpha channel
-    alpha = new_asset[:, :, 3]
-    alpha = cv2.merge([alpha, alpha, alpha])
-    
-    # extract the rgb channels of the asset
-    front = new_asset[:, :, 0:3]
+    asset, dx, dy = fit_asset(asset, w, h, flip_x, flip_y)
+    if asset is None:
+        return out
 
-    # replace the img_crop pixels where alpha = 0 (not transparent) with 
-    # the asset rgb pixels
-    result = np.where(alpha == (0, 0, 0), img_crop, front) 
+    return blend_asset(out, asset, x + dx, y + dy)
     
-    # replace the bounding box with the img_crop
-    img[max(y1, 0):min(y2, H), max(x1, 0):min(x2, W), :] = result
-    new_image = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+def face_box(detection, offset_x = 0, offset_y = 0, scale = 1):
+    """
+    Bounding box of an asset placed on the face detection (x, y, w, h):
+    (x + offset_x, y + offset_y, scale * w, scale * h)
+    """
+    x, y, w, h = detection
+
+    new_w = int(w * scale)
+    new_h = int(h * scale)
+    return x + offset_x, y + offset_y, new_w, new_h
+
+def hat_box(detection, offset_x = 0, offset_y = 0, scale = 1):
+    """
+    Bounding box of a hat placed on the face detection (x, y, w, h), 
+    raised by half its height so that it sits on the head
+    """
+    x, y, w, h = detection
+
+    new_w = int(w * scale)
+    new_h = int(h * scale)
+    return x + offset_x, y + offset_y - new_h // 2, new_w, new_h
 
-    return new_image
-    
 def add_asset(assets, detections, face_index, asset_index, img, offset_y = 0, offset_x = 0, bounding_box_scale = 1, flip_x = 0, flip_y = 0):
     """
     Add asset with index = asset_index from assets to face with index = face_index from detections
@@ -135,47 +137,84 @@ def add_asset(assets, detections, face_index, asset_index, img, offset_y = 0, of
 
     # choose asset
     asset_file = assets[asset_index]
-    asset = cv2.imread(asset_file, cv2.IMREAD_UNCHANGED)
+    asset = get_asset(asset_file) # decoded once and kept in the asset store
     
     # extract img dimensions
     image = img
     H, W, c = img.shape
 
-    # extract bounding box coordinates
-    detection = detections[face_index]
-    x, y, w, h = detection 
-
     # new bounding box coordinates
-    new_w = int(w * bounding_box_scale)
-    new_h = int(h * bounding_box_scale)
-    new_x = x + offset_x
-    new_y = y + offset_y
+    new_x, new_y, new_w, new_h = face_box(detections[face_index], offset_x, offset_y, bounding_box_scale)
     
-    # add asset to image
-    image = cv2.cvtColor(image, cv2.COLOR_RGB2BGR)
+    # add asset to image (assets are stored in rgba, the order of img)
     image = overlay_image(image, asset, new_x, new_y, new_w, new_h, flip_x, flip_y)
     
     return image
 
 def add_hat(assets, detections, face_index, asset_index, img, offset_y = 0, offset_x = 0, asset_scale = 1, flip_x = 0, flip_y = 0):
     asset_file = assets[asset_index]
-    asset = cv2.imread(asset_file, cv2.IMREAD_UNCHANGED)
+    asset = get_asset(asset_file) # decoded once and kept in the asset store
 
     image = img
     H, W, c = img.shape
 
-    detection = detections[face_index]
-    x, y, w, h = detection
-
-    new_w = int(w * asset_scale)
-    new_h = int(h * asset_scale)
-    new_x = x + offset_x
-    new_y = y + offset_y - new_h // 2
+    new_x, new_y, new_w, new_h = hat_box(detections[face_index], offset_x, offset_y, asset_scale)
 
-    image = cv2.cvtColor(image, cv2.COLOR_RGB2BGR)
     image = overlay_image(image, asset, new_x, new_y, new_w, new_h, flip_x, flip_y)
 
     return image
 
+def proportional_policy(scale = 1, dx = 0, dy = 0):
+    """
+    Placement policy for add_asset_to_faces: every asset is scaled by scale and 
+    shifted by dx, dy times the width, height of its face box
+    """
+    def policy(detection):
+        _, _, w, h = detection
+        return scale, int(dx * w), int(dy * h)
+    return policy
+
+def add_asset_to_faces(assets, detections, img, place = face_box, policy = None, 
+                       flip_x = 0, flip_y = 0, out = None):
+    """
+    Add assets to every face in detections in one pass over a single output image
+    assets: an asset file used for every face, a list with one asset file per face, 
+    or a dict face index -> asset file (faces missing from it are skipped)
+    place: face_box for meme assets and glasses, hat_box for hats
+    policy: function detection -> (scale, offset_x, offset_y), 
+    proportional_policy() (the add_asset defaults) if None
+    out: buffer the result is written to (may be img itself), if None a copy of img is made
+    """
+    if policy is None:
+        policy = proportional_policy()
+
+    if isinstance(assets, str):
+        assets = {i: assets for i in range(len(detections))}
+    elif not isinstance(assets, dict):
+        assets = dict(enumerate(assets))
+
+    if out is None:
+        out = img.copy()
+    elif out is not img:
+        np.copyto(out, img)
+
+    # faces of the same size share the resized asset
+    fitted = {}
+
+    for face_index, detection in enumerate(detections):
+        asset_file = assets.get(face_index)
+        if asset_file is None:
+            continue
+
+        scale, offset_x, offset_y = policy(detection)
+        x, y, w, h = place(detection, offset_x, offset_y, scale)
+
+        key = (asset_file, w, h)
+        if key not in fitted:
+            fitted[key] = fit_asset(get_asset(asset_file), w, h, flip_x, flip_y)
 
+        asset, dx, dy = fitted[key]
+        if asset is not None:
+            blend_asset(out, asset, x + dx, y + dy)
 
+    return out